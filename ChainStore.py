@@ -0,0 +1,600 @@
+from req_import import *
+
+# Stat name -> store column of the precomputed mid-price IV/Greeks surface
+SURFACE_COLUMNS = {'iv': 'mid_iv', 'delta': 'mid_delta', 'gamma': 'mid_gamma', 'theta': 'mid_theta',
+                   'vega': 'mid_vega'}
+
+
+def _open_map_limit() -> int:
+    """
+    Half the soft limit on open file descriptors, leaving the other half to the rest of the process
+    """
+    try:
+        import resource  # Unix only
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, OSError, ValueError):
+        return 256
+    return 8192 if soft == resource.RLIM_INFINITY else max(soft // 2, 16)
+
+
+class ChainStore:
+    """
+    Columnar, memory-mapped store of a preprocessed options chain.
+
+    Every trade date is a partition directory holding one ``.npy`` file per column. Dates are int32 day ordinals
+    (days since 1970-01-01), string columns are int32 codes into a store-wide dictionary and strikes are float32, so
+    partitions open with ``np.load(mmap_mode='r')`` and every process reading the store shares one page-cache copy.
+    Only the MAX_OPEN_MAPS most recently used column maps are kept open, as each holds a file descriptor.
+    The store is append-only: new trade dates become new partitions and dictionaries only ever grow, so the codes in
+    partitions already written keep their meaning.
+    """
+    VERSION = 1
+    _MANIFEST = 'manifest.json'
+    _DATE_COLS = ('date', 'expiration')
+    _CATEGORICAL_COLS = ('option_symbol', 'call_put')
+    # Listed strikes are exact in float32. Quotes and the underlying stay float64 as PnL is taken straight off them
+    _FLOAT32_COLS = ('strike',)
+    # Column memory maps kept open. Each holds a file descriptor
+    MAX_OPEN_MAPS = _open_map_limit()
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, self._MANIFEST)) as f:
+            self.manifest = json.load(f)
+        assert self.manifest['version'] == self.VERSION, f"Unsupported store version in {path}"
+        self.columns: List[str] = list(self.manifest['columns'])
+        self.categorical: List[str] = self.manifest['categorical']
+        self._categories = {}
+        self._load_index()
+
+    def _load_index(self):
+        self.dates = np.array([p['date'] for p in self.manifest['partitions']], dtype=np.int32)
+        self.rows = np.array([p['rows'] for p in self.manifest['partitions']], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.rows)])
+        # (date ordinal, column) -> memory map, least recently used first
+        self._maps = OrderedDict()
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def exists(cls, path) -> bool:
+        fp = os.path.join(path, cls._MANIFEST)
+        if not os.path.exists(fp):
+            return False
+        with open(fp) as f:
+            return json.load(f).get('version') == cls.VERSION
+
+    @property
+    def source(self) -> Optional[dict]:
+        return self.manifest.get('source')
+
+    def _write_manifest(self):
+        tmp_fp = os.path.join(self.path, self._MANIFEST + '.tmp')
+        with open(tmp_fp, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_fp, os.path.join(self.path, self._MANIFEST))
+
+    def update_source(self, source: dict):
+        self.manifest['source'] = source
+        self._write_manifest()
+
+    @staticmethod
+    def ordinal(dt) -> int:
+        """
+        Day ordinal of a date, datetime, Timestamp or datetime64
+        """
+        return int(np.datetime64(pd.Timestamp(dt).date(), 'D').astype(np.int64))
+
+    def day_range(self, start_ordinal: int, end_ordinal: int) -> Tuple[int, int]:
+        """
+        Partitions [lo, hi) whose trade date falls within [start_ordinal, end_ordinal]. Binary search on the date index
+        """
+        lo = int(np.searchsorted(self.dates, start_ordinal, side='left'))
+        hi = int(np.searchsorted(self.dates, end_ordinal, side='right'))
+        return lo, hi
+
+    @staticmethod
+    def _partition_dir(ordinal) -> str:
+        return str(np.datetime64(int(ordinal), 'D'))
+
+    @classmethod
+    def _store_dtype(cls, col, dtype) -> Tuple[str, bool]:
+        """
+        On-disk dtype of a column of the given (decoded) dtype and whether it is dictionary encoded
+        """
+        dtype = np.dtype(dtype)
+        if col in cls._DATE_COLS:
+            return np.dtype(np.int32).str, False
+        if col in cls._CATEGORICAL_COLS or dtype == object or not is_numeric_dtype(dtype):
+            return np.dtype(np.int32).str, True
+        if is_float_dtype(dtype):
+            return np.dtype(np.float32 if col in cls._FLOAT32_COLS else np.float64).str, False
+        return dtype.str, False
+
+    @classmethod
+    def create(cls, path, columns: Dict[str, Any], source: Optional[dict] = None) -> 'ChainStore':
+        """
+        Empty store with a fixed schema, replacing any existing store at ``path``. Fill it with ``append``
+        :raises FileExistsError: When ``path`` is a directory with other contents than a store
+        :param columns: Column -> dtype of the decoded chain, e.g. object for strings and datetime64 for dates
+        :param source: Fingerprint of the raw file the chain is built from
+        """
+        if os.path.exists(path):
+            entries = os.listdir(path)
+            # A store of any version, or what is left of one interrupted before its manifest was written
+            if cls._MANIFEST not in entries and not all(e.endswith('.categories.npy') for e in entries):
+                raise FileExistsError(f"{path} is not empty and not a chain store, refusing to replace it")
+            shutil.rmtree(path)
+        os.makedirs(path)
+        schema = {col: cls._store_dtype(col, dtype) for col, dtype in columns.items()}
+        categorical = [col for col, (_, is_categorical) in schema.items() if is_categorical]
+        for col in categorical:
+            np.save(os.path.join(path, f"{col}.categories.npy"), np.array([], dtype=str))
+        manifest = {'version': cls.VERSION,
+                    'columns': {col: dtype for col, (dtype, _) in schema.items()},
+                    'categorical': categorical,
+                    'source': source,
+                    'partitions': []}
+        # Manifest goes last so a half written store is never picked up
+        with open(os.path.join(path, cls._MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+        return cls(path)
+
+    @classmethod
+    def write(cls, df: pd.DataFrame, path, source: Optional[dict] = None) -> 'ChainStore':
+        """
+        Write a preprocessed chain to ``path``, replacing any existing store
+        :param df: Output of Dataset.preprocess
+        :param path: Store directory
+        :param source: Fingerprint of the raw file the chain was built from
+        """
+        store = cls.create(path, df.dtypes.to_dict(), source=source)
+        store.append(df)
+        return store
+
+    def _encode_categories(self, col, values: np.ndarray) -> np.ndarray:
+        """
+        Codes of ``values`` in the dictionary of ``col``. Unseen values are added at the end of the dictionary so
+        the codes already written keep their meaning
+        """
+        cats = self.categories(col)
+        codes = cats.get_indexer(values)
+        unseen = codes < 0
+        if unseen.any():
+            cats = cats.append(pd.Index(np.sort(pd.unique(values[unseen])), dtype=object))
+            tmp_fp = os.path.join(self.path, f"{col}.categories.tmp.npy")
+            np.save(tmp_fp, np.asarray(cats, dtype=str))
+            os.replace(tmp_fp, os.path.join(self.path, f"{col}.categories.npy"))
+            self._categories[col] = cats
+            codes[unseen] = cats.get_indexer(values[unseen])
+        return codes.astype(np.int32)
+
+    def append(self, df: pd.DataFrame) -> List[int]:
+        """
+        Add the trade dates of ``df`` the store does not have yet, one new partition each. Rows of dates already in the
+        store are ignored. Only the new rows are encoded and sorted, existing partitions are left untouched
+        :param df: Preprocessed chain with the store's columns, in any order
+        :return: Day ordinals of the partitions added
+        """
+        dates = df['date'].values.astype('datetime64[D]').astype(np.int32)
+        new = ~np.isin(dates, self.dates)
+        if not new.any():
+            return []
+        df, dates = df[new], dates[new]
+        # Partition by date, and within a date by expiration and strike as preprocess sorts the whole chain
+        order = np.lexsort((df['strike'].values, df['expiration'].values, dates))
+        df, dates = df.iloc[order], dates[order]
+
+        arrays = {}
+        for col, dtype in self.manifest['columns'].items():
+            values = df[col].values
+            if col in self._DATE_COLS:
+                arrays[col] = values.astype('datetime64[D]').astype(np.int32)
+            elif col in self.categorical:
+                arrays[col] = self._encode_categories(col, np.asarray(values, dtype=object))
+            else:
+                arrays[col] = values.astype(dtype)
+
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(dates)) + 1, [len(dates)]])
+        added = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            part_dir = os.path.join(self.path, self._partition_dir(dates[start]))
+            os.makedirs(part_dir, exist_ok=True)
+            for col, arr in arrays.items():
+                np.save(os.path.join(part_dir, f"{col}.npy"), arr[start:stop])
+            self.manifest['partitions'].append({'date': int(dates[start]), 'rows': int(stop - start)})
+            added.append(int(dates[start]))
+
+        self.manifest['partitions'].sort(key=lambda p: p['date'])
+        self._write_manifest()
+        self._load_index()
+        return added
+
+    def categories(self, col) -> pd.Index:
+        if col not in self._categories:
+            cats = np.load(os.path.join(self.path, f"{col}.categories.npy"), mmap_mode='r')
+            self._categories[col] = pd.Index(cats, dtype=object)
+        return self._categories[col]
+
+    def partition_columns(self, i) -> List[str]:
+        """
+        Base columns plus the derived columns computed so far for the i-th trade date
+        """
+        return self.columns + self.manifest['partitions'][i].get('extra', [])
+
+    def partition(self, i, columns=None) -> dict:
+        """
+        Raw (encoded) column arrays of the i-th trade date. Arrays are read-only memory maps
+        """
+        return {col: self._map(i, col) for col in (self.partition_columns(i) if columns is None else columns)}
+
+    def _map(self, i, col) -> np.ndarray:
+        key = (int(self.dates[i]), col)
+        arr = self._maps.get(key)
+        if arr is not None:
+            self._maps.move_to_end(key)
+            return arr
+        if col not in self.partition_columns(i):
+            raise KeyError(col)
+        arr = np.load(os.path.join(self.path, self._partition_dir(key[0]), f"{col}.npy"), mmap_mode='r')
+        self._maps[key] = arr
+        if len(self._maps) > self.MAX_OPEN_MAPS:
+            # Closed once no array still references it
+            self._maps.popitem(last=False)
+        return arr
+
+    def read_partition(self, i, columns=None) -> dict:
+        """
+        Raw (encoded) column arrays of the i-th trade date read into memory. Unlike ``partition`` nothing is mapped or
+        kept, so the memory is released with the arrays
+        """
+        part_dir = os.path.join(self.path, self._partition_dir(self.dates[i]))
+        return {col: np.load(os.path.join(part_dir, f"{col}.npy"))
+                for col in (self.partition_columns(i) if columns is None else columns)}
+
+    def save_columns(self, i, arrays: Dict[str, np.ndarray]):
+        """
+        Write derived columns of the i-th trade date. They are only picked up once ``register_columns`` is called
+        """
+        part_dir = os.path.join(self.path, self._partition_dir(self.dates[i]))
+        for col, arr in arrays.items():
+            np.save(os.path.join(part_dir, f"{col}.npy"), arr)
+
+    def register_columns(self, partitions: List[int], columns: List[str]):
+        for i in partitions:
+            extra = self.manifest['partitions'][i].setdefault('extra', [])
+            extra.extend(col for col in columns if col not in extra)
+            for col in columns:
+                self._maps.pop((int(self.dates[i]), col), None)
+        self._write_manifest()
+
+    def missing(self, columns) -> List[int]:
+        """
+        Partitions lacking any of the given derived columns
+        """
+        return [i for i in range(len(self)) if not set(columns) <= set(self.partition_columns(i))]
+
+    def decode(self, arrays: dict) -> pd.DataFrame:
+        out = {}
+        for col, arr in arrays.items():
+            if col in self._DATE_COLS:
+                out[col] = arr.astype('datetime64[D]').astype('datetime64[ns]')
+            elif col in self.categorical:
+                out[col] = pd.Categorical.from_codes(arr, categories=self.categories(col), validate=False)
+            else:
+                out[col] = arr
+        return pd.DataFrame(out, copy=False)
+
+    def frame(self, i, columns=None) -> pd.DataFrame:
+        return self.decode(self.partition(i, columns))
+
+    def to_frame(self, columns=None) -> pd.DataFrame:
+        """
+        Materialize the whole chain in memory with the same schema ``load_and_preprocess`` used to return
+        """
+        return ChainView(self).to_frame(self.columns if columns is None else columns)
+
+
+class DayChain:
+    """
+    One trade date of the chain as column arrays. The symbol -> row index and the strike ladders (sorted strikes per
+    (call_put, expiration)) are built on first lookup and shared by every position processed that day
+    """
+    def __init__(self, date, arrays: Dict[str, np.ndarray], categories: Optional[Dict[str, pd.Index]] = None,
+                 frame: Optional[pd.DataFrame] = None, underlying: Optional[float] = None,
+                 expirations: Optional[np.ndarray] = None):
+        """
+        :param date: Trade date
+        :param arrays: Column arrays. Dates are day ordinals, categorical columns are codes into ``categories``
+        :param categories: Dictionaries of the categorical columns. Columns not listed here are used as is
+        :param frame: The chain as a frame, if it already exists
+        :param underlying: Underlying close, when the arrays may not have a row to take it from
+        :param expirations: Sorted expirations listed that day, when the arrays are a pruned subset of its rows
+        """
+        self.date = pd.Timestamp(date)
+        self._underlying = underlying
+        self.arrays = arrays
+        self._categories = categories or {}
+        self._decoded = {}
+        self._frame = frame
+        self._expirations = expirations
+        self._symbol_index = None
+        self._strike_index = None
+
+    @classmethod
+    def from_store(cls, store: ChainStore, i) -> 'DayChain':
+        categories = {col: store.categories(col) for col in store.categorical}
+        return cls(np.datetime64(int(store.dates[i]), 'D'), store.partition(i), categories)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'DayChain':
+        arrays = {col: df[col].to_numpy() for col in df.columns}
+        for col in ChainStore._DATE_COLS:
+            arrays[col] = arrays[col].astype('datetime64[D]').astype(np.int32)
+        return cls(df['date'].iloc[0], arrays, frame=df)
+
+    def __len__(self):
+        return len(self.arrays['date'])
+
+    def __getitem__(self, col) -> np.ndarray:
+        """
+        Decoded column: strings for categorical columns, day ordinals for dates, raw values otherwise
+        """
+        if col not in self._categories:
+            return self.arrays[col]
+        if col not in self._decoded:
+            self._decoded[col] = self._categories[col].to_numpy()[self.arrays[col]]
+        return self._decoded[col]
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        if self._frame is None:
+            out = {}
+            for col, arr in self.arrays.items():
+                if col in ChainStore._DATE_COLS:
+                    out[col] = arr.astype('datetime64[D]').astype('datetime64[ns]')
+                elif col in self._categories:
+                    out[col] = pd.Categorical.from_codes(arr, categories=self._categories[col], validate=False)
+                else:
+                    out[col] = arr
+            self._frame = pd.DataFrame(out, copy=False)
+        return self._frame
+
+    @property
+    def ordinal(self) -> int:
+        return ChainStore.ordinal(self.date)
+
+    @property
+    def has_surface(self) -> bool:
+        return all(col in self.arrays for col in SURFACE_COLUMNS.values())
+
+    def surface(self, rows) -> Dict[str, np.ndarray]:
+        """
+        Precomputed IV and Greeks of the given rows
+        """
+        return {stat: self.arrays[col][rows] for stat, col in SURFACE_COLUMNS.items()}
+
+    @property
+    def underlying(self) -> float:
+        if self._underlying is not None:
+            return self._underlying
+        return float(self.arrays['adjusted_close'][0])
+
+    @property
+    def expirations(self) -> np.ndarray:
+        """
+        Sorted listed expirations as day ordinals
+        """
+        if self._expirations is None:
+            self._expirations = np.unique(self.arrays['expiration'])
+        return self._expirations
+
+    def symbol_row(self, symbol: str) -> int:
+        if self._symbol_index is None:
+            self._symbol_index = {s: i for i, s in enumerate(self['option_symbol'].tolist())}
+        return self._symbol_index[symbol]
+
+    def strike_ladder(self, call_put: str, expiration: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Listed strikes of (call_put, expiration) in ascending order and their rows
+        :param call_put: 'C' or 'P'
+        :param expiration: Expiration as a day ordinal
+        """
+        if self._strike_index is None:
+            is_call = self['call_put'] == 'C'
+            expiration_col = self.arrays['expiration']
+            order = np.lexsort((self.arrays['strike'], expiration_col, is_call))
+            is_call, expiration_col = is_call[order], expiration_col[order]
+            strikes = self.arrays['strike'][order].astype(np.float64)
+            starts = np.flatnonzero(np.r_[True, (is_call[1:] != is_call[:-1]) |
+                                          (expiration_col[1:] != expiration_col[:-1])])
+            ends = np.r_[starts[1:], len(order)]
+            self._strike_index = {('C' if is_call[a] else 'P', int(expiration_col[a])): (strikes[a:b], order[a:b])
+                                  for a, b in zip(starts, ends)}
+        key = (call_put, int(expiration))
+        assert key in self._strike_index, "No matching option"
+        return self._strike_index[key]
+
+    def nearest_strike_row(self, call_put: str, expiration: int, strike: float,
+                           tie: Literal['up', 'down', 'otm', 'itm'] = 'up') -> int:
+        """
+        Row of the listed strike of (call_put, expiration) nearest to ``strike``, by binary search on its ladder
+        :param tie: Strike taken when two are equally near. The higher or lower one, or the one further out of or
+                    into the money
+        """
+        strikes, rows = self.strike_ladder(call_put, expiration)
+        i = int(np.searchsorted(strikes, strike))
+        below, above = max(i - 1, 0), min(i, len(strikes) - 1)
+        to_below, to_above = strike - strikes[below], strikes[above] - strike
+        if to_below == to_above:
+            # Out of the money is up for calls, down for puts
+            up = tie == 'up' if tie in ('up', 'down') else (tie == 'otm') == (call_put == 'C')
+            i = above if up else below
+        else:
+            i = below if to_below < to_above else above
+        assert (i == 0 or strikes[i - 1] != strikes[i]) and (i == len(strikes) - 1 or strikes[i + 1] != strikes[i]), \
+            "Multiple matching options"
+        return int(rows[i])
+
+    def symbol(self, row) -> str:
+        return self['option_symbol'][row]
+
+    def expiry(self, row) -> pd.Timestamp:
+        return pd.Timestamp(np.datetime64(int(self.arrays['expiration'][row]), 'D'))
+
+
+class ChainView:
+    """
+    Pruned read-only view of a store: a window of trade dates and optionally one option type, expirations up to a bound
+    and a subset of columns. The predicates are applied to each partition as it is read, so only the selected rows and
+    columns of the window are ever materialized. Partitions are sorted by expiration, which makes the expiration bound
+    a slice of the memory map rather than a copy
+    """
+    def __init__(self, store: ChainStore, lo: int = 0, hi: Optional[int] = None, call_put: Optional[str] = None,
+                 max_expiration: Optional[int] = None, columns: Optional[List[str]] = None):
+        """
+        :param lo: First partition of the window
+        :param hi: End (exclusive) of the window. Defaults to the last partition
+        :param call_put: 'C' or 'P' to keep that option type only
+        :param max_expiration: Last expiration to keep, as a day ordinal
+        :param columns: Columns to keep. Defaults to all columns of every partition, derived ones included
+        """
+        self.store = store
+        self.lo = lo
+        self.hi = len(store) if hi is None else hi
+        self.call_put = call_put
+        self.max_expiration = max_expiration
+        self.columns = columns
+        self.dates = store.dates[self.lo:self.hi]
+        self._call_put_code = None
+        if call_put is not None:
+            cats = store.categories('call_put')
+            self._call_put_code = cats.get_loc(call_put) if call_put in cats else -1
+        self._selection = {}
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def _rows(self, i):
+        """
+        Selected rows of the i-th partition of the store, as a slice when no copy is needed
+        """
+        if i not in self._selection:
+            assert self.lo <= i < self.hi, "Trade date outside of the view"
+            self._selection[i] = self._select(self.store.partition(i, ['expiration', 'call_put']))
+        return self._selection[i]
+
+    def _select(self, part: dict):
+        stop = len(part['expiration'])
+        if self.max_expiration is not None:
+            stop = int(np.searchsorted(part['expiration'], self.max_expiration, side='right'))
+        rows = slice(0, stop)
+        if self._call_put_code is not None:
+            rows = np.flatnonzero(part['call_put'][:stop] == self._call_put_code)
+        return rows
+
+    @property
+    def rows(self) -> np.ndarray:
+        """
+        Number of selected rows of every trade date of the window
+        """
+        selections = (self._rows(i) for i in range(self.lo, self.hi))
+        return np.array([r.stop if isinstance(r, slice) else len(r) for r in selections], dtype=np.int64)
+
+    def partition(self, i, columns=None) -> dict:
+        """
+        Encoded column arrays of the selected rows of the i-th partition of the store
+        """
+        columns = columns or self.columns or self.store.partition_columns(i)
+        rows = self._rows(i)
+        return {col: arr[rows] for col, arr in self.store.partition(i, columns).items()}
+
+    def chain(self, i) -> DayChain:
+        """
+        The selected rows of the i-th partition. Its expiration ladder is the day's full one, so that pruning never
+        changes which expiration a position selects
+        """
+        categories = {col: self.store.categories(col) for col in self.store.categorical}
+        full = self.store.partition(i, ['adjusted_close', 'expiration'])
+        return DayChain(np.datetime64(int(self.store.dates[i]), 'D'), self.partition(i), categories,
+                        underlying=float(full['adjusted_close'][0]), expirations=np.unique(full['expiration']))
+
+    @property
+    def underlying(self) -> np.ndarray:
+        """
+        Underlying close of every trade date of the window, whether or not the day has selected rows
+        """
+        return np.array([self.store.partition(i, ['adjusted_close'])['adjusted_close'][0]
+                         for i in range(self.lo, self.hi)])
+
+    def stream(self, read_ahead: int = 2):
+        """
+        Yield (i, DayChain) for every trade date of the view in order, read by a background thread that stays at most
+        ``read_ahead`` days ahead. Partitions are read into memory, not mapped, and nothing is cached, so memory holds
+        the current day plus the read-ahead however long the window
+        """
+        days = queue.Queue(maxsize=max(read_ahead, 1))
+        stop = threading.Event()
+        categories = {col: self.store.categories(col) for col in self.store.categorical}
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    days.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read():
+            try:
+                for i in range(self.lo, self.hi):
+                    columns = self.columns or self.store.partition_columns(i)
+                    part = self.store.read_partition(i, list(dict.fromkeys(
+                        [*columns, 'expiration', 'call_put', 'adjusted_close'])))
+                    rows = self._select(part)
+                    chain = DayChain(np.datetime64(int(self.store.dates[i]), 'D'),
+                                     {col: part[col][rows] for col in columns}, categories,
+                                     underlying=float(part['adjusted_close'][0]),
+                                     expirations=np.unique(part['expiration']))
+                    if not put((i, chain)):
+                        return
+                put(None)
+            except BaseException as e:
+                put(e)
+
+        reader = threading.Thread(target=read, name='chain-read-ahead', daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = days.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            reader.join()
+
+    def concat(self, columns) -> Dict[str, np.ndarray]:
+        """
+        Encoded columns of the whole window, one array per column. Each day is copied straight into the output, so no
+        partition stays mapped once it is read
+        """
+        rows = self.rows
+        out, start = {}, 0
+        for i, n in zip(range(self.lo, self.hi), rows):
+            for col, arr in self.partition(i, columns).items():
+                if col not in out:
+                    out[col] = np.empty(rows.sum(), dtype=arr.dtype)
+                out[col][start:start + n] = arr
+            start += n
+        return {col: out[col] if col in out else np.empty(0) for col in columns}
+
+    def to_frame(self, columns=None) -> pd.DataFrame:
+        """
+        The view decoded as a frame, with the schema of ChainStore.to_frame
+        """
+        return self.store.decode(self.concat(columns or self.columns or self.store.columns))
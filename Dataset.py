@@ -0,0 +1,384 @@
+from req_import import *
+from ChainStore import ChainStore, DayChain, ChainView
+from surface import build_surface
+from quotes import QUOTE_DTYPES, add_quote_quality, quality_report
+
+# Bump whenever preprocess() changes its output so existing stores get rebuilt
+PREPROCESS_VERSION = 3
+RAW_CSV_FP = r"raw_input.csv"
+STORE_FP = r"final_input"
+_HASH_CHUNK = 1 << 20
+# Rows per chunk when streaming the raw file into the store
+CHUNK_ROWS = 500_000
+# Raw column -> (chain column, raw dtype). The chain keeps exactly these columns whatever the data looks like, so
+# appending days can never change the schema. The constant columns (symbol, exchange, style) and unadjusted (equal to
+# adjusted close) are not read at all
+SCHEMA = {'date': ('date', str),
+          'adjusted close': ('adjusted_close', np.float64),
+          'expiration': ('expiration', str),
+          'strike': ('strike', np.float64),
+          'call/put': ('call_put', str),
+          'ask': ('ask', np.float64),
+          'bid': ('bid', np.float64),
+          'option symbol': ('option_symbol', str)}
+_DATE_FORMAT = '%Y-%m-%d'
+
+
+def preprocess(df: pd.DataFrame, sort: bool = True) -> pd.DataFrame:
+    """
+    Raw chain -> chain with the SCHEMA columns, renamed for attribute access (df.adjusted_close) and dates parsed, plus
+    the quote quality columns of quotes.py
+    :param sort: Sort by date, expiration and strike. Not needed for chunks going into the store, which sorts per date
+    """
+    df = df[list(SCHEMA)].rename(columns={raw: col for raw, (col, _) in SCHEMA.items()})
+    df['date'] = pd.to_datetime(df['date'], format=_DATE_FORMAT)
+    df['expiration'] = pd.to_datetime(df['expiration'], format=_DATE_FORMAT)
+    df = add_quote_quality(df)
+    if sort:
+        df = df.sort_values(['date', 'expiration', 'strike'])
+    return df
+
+
+def chain_dtypes() -> Dict[str, Any]:
+    """
+    Column -> dtype of a preprocessed chain
+    """
+    return {**{col: np.dtype('datetime64[ns]') if col in ChainStore._DATE_COLS else np.dtype(dtype)
+               for col, dtype in SCHEMA.values()}, **QUOTE_DTYPES}
+
+
+def read_raw(fp, chunksize: int = CHUNK_ROWS, offset: int = 0):
+    """
+    Stream a raw file as preprocessed (unsorted) chunks, parsed with the declared SCHEMA dtypes
+    :param offset: Byte offset of the first row to read, at a line start. The header is still taken from the top
+    :raises ValueError: When the header lacks SCHEMA columns. Names are matched stripped and lowercased
+    """
+    header = pd.read_csv(fp, nrows=0).columns.str.strip().str.lower()
+    missing = [raw for raw in SCHEMA if raw not in header]
+    if missing:
+        raise ValueError(f"{fp} lacks the columns {missing}, its header is {header.tolist()}")
+    with open(fp, 'rb') as f:
+        if offset:
+            f.seek(offset)
+        reader = pd.read_csv(f, header=None if offset else 0, names=header, usecols=list(SCHEMA),
+                             dtype={raw: dtype for raw, (_, dtype) in SCHEMA.items()}, chunksize=chunksize)
+        for chunk in reader:
+            yield preprocess(chunk, sort=False)
+
+
+def ingest_chunks(store: ChainStore, chunks) -> List[int]:
+    """
+    Append the trade dates of a stream of preprocessed chunks that the store does not have yet. Chunks must come in
+    date order, as rows do in the raw file, but the rows of one date may span chunks: the last date of every chunk is
+    held back until the next chunk shows it is complete
+    :return: Day ordinals of the partitions added
+    """
+    added, pending, flushed = [], None, None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        if len(chunk) == 0:
+            continue
+        dates = chunk['date']
+        if flushed is not None and dates.min() <= flushed:
+            raise ValueError("Raw file is not sorted by date")
+        last = dates.max()
+        complete = (dates < last).values
+        pending = chunk[~complete]
+        if complete.any():
+            added += store.append(chunk[complete])
+            flushed = dates[complete].max()
+    if pending is not None and len(pending):
+        added += store.append(pending)
+    return added
+
+
+def file_fingerprint(fp, digest: Optional[str] = None) -> dict:
+    """
+    Content fingerprint of a raw input file
+    :param digest: Known sha1 of the file. Only computed when not provided
+    """
+    st = os.stat(fp)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(fp, 'rb') as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': digest, 'version': PREPROCESS_VERSION}
+
+
+def _validate_fingerprint(fp, source: Optional[dict]) -> Optional[dict]:
+    """
+    Returns the (possibly refreshed) fingerprint if ``source`` still describes ``fp``, None if the file changed
+    """
+    if source is None or source.get('version') != PREPROCESS_VERSION:
+        return None
+    if not os.path.exists(fp):  # Store shipped without its raw file
+        return source
+    st = os.stat(fp)
+    if st.st_size != source['size']:
+        return None
+    if st.st_mtime_ns == source['mtime_ns']:
+        return source
+    # Touched but maybe not modified: only now is the file worth hashing
+    current = file_fingerprint(fp)
+    return current if current['sha1'] == source['sha1'] else None
+
+
+def _appended_fingerprint(fp, source: Optional[dict]) -> Optional[dict]:
+    """
+    Fingerprint of ``fp`` if it is the file ``source`` describes with rows appended at the end, None otherwise
+    """
+    if source is None or source.get('version') != PREPROCESS_VERSION or not os.path.exists(fp):
+        return None
+    if os.stat(fp).st_size <= source['size']:
+        return None
+    h = hashlib.sha1()
+    remaining, last = source['size'], b''
+    with open(fp, 'rb') as f:
+        while remaining:
+            chunk = f.read(min(_HASH_CHUNK, remaining))
+            h.update(chunk)
+            remaining -= len(chunk)
+            last = chunk[-1:]
+        if h.hexdigest() != source['sha1'] or last != b'\n':
+            return None
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            h.update(chunk)
+    return file_fingerprint(fp, digest=h.hexdigest())
+
+
+class Dataset:
+    """
+    Lazily opened handle on a preprocessed chain. Nothing is read until the store or the frame is first used, and the
+    store is only rebuilt when the raw file's fingerprint no longer matches the one it was built from. When the raw
+    file only had rows appended, just the appended rows are read and their new trade dates added to the store
+    """
+    def __init__(self, csv_fp: str = RAW_CSV_FP, store_fp: str = STORE_FP, surface: bool = False):
+        """
+        :param surface: Precompute the IV/Greeks surface of every trade date when the store is opened
+        """
+        self.csv_fp = csv_fp
+        self.store_fp = store_fp
+        self.surface = surface
+        self._store: Optional[ChainStore] = None
+        self._frame: Optional[pd.DataFrame] = None
+        self._dates: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+
+    def _open(self) -> ChainStore:
+        store = None
+        if ChainStore.exists(self.store_fp):
+            store = ChainStore(self.store_fp)
+            source = _validate_fingerprint(self.csv_fp, store.source)
+            if source is None:
+                source = _appended_fingerprint(self.csv_fp, store.source)
+                if source is None or self._continues_last_date(store):
+                    store = None
+                else:
+                    ingest_chunks(store, read_raw(self.csv_fp, offset=store.source['size']))
+                    store.update_source(source)
+            elif source != store.source:
+                store.update_source(source)
+        if store is None:
+            store = self._build()
+        if self.surface:
+            build_surface(store)
+        return store
+
+    def _continues_last_date(self, store: ChainStore) -> bool:
+        """
+        Whether the rows appended to the raw file since the store was built start on a trade date the store already
+        has, e.g. the rest of a day captured mid-session. ``append`` skips such dates, so the store must be rebuilt
+        """
+        with contextlib.closing(read_raw(self.csv_fp, chunksize=1, offset=store.source['size'])) as chunks:
+            first = next(chunks, None)
+        return first is not None and len(first) > 0 and len(store) > 0 and \
+            ChainStore.ordinal(first['date'].iloc[0]) <= store.dates[-1]
+
+    def _build(self) -> ChainStore:
+        source = file_fingerprint(self.csv_fp)
+        store = ChainStore.create(self.store_fp, chain_dtypes())
+        ingest_chunks(store, read_raw(self.csv_fp))
+        # Only a complete store records its source, an interrupted build is redone on the next open
+        store.update_source(source)
+        return store
+
+    @property
+    def store(self) -> ChainStore:
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = self._open()
+        return self._store
+
+    @property
+    def fingerprint(self) -> dict:
+        return self.store.source
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        if self._frame is None:
+            with self._lock:
+                if self._frame is None:
+                    self._frame = self.store.to_frame()
+        return self._frame
+
+    @property
+    def dates(self) -> np.ndarray:
+        """
+        Sorted trade dates as datetime64[ns]
+        """
+        if self._dates is None:
+            self._dates = self.store.dates.astype('datetime64[D]').astype('datetime64[ns]')
+        return self._dates
+
+    @property
+    def min_date(self) -> pd.Timestamp:
+        return pd.Timestamp(self.dates[0])
+
+    @property
+    def max_date(self) -> pd.Timestamp:
+        return pd.Timestamp(self.dates[-1])
+
+    def day_range(self, start_date, end_date) -> Tuple[int, int]:
+        """
+        Indices [lo, hi) into ``dates`` of the trade dates within [start_date, end_date]
+        """
+        return self.store.day_range(ChainStore.ordinal(start_date), ChainStore.ordinal(end_date))
+
+    def day(self, i) -> pd.DataFrame:
+        """
+        Chain of the i-th trade date. Numeric columns are views on the memory-mapped partition, nothing is copied
+        """
+        return self.store.frame(i)
+
+    def chain(self, i) -> DayChain:
+        """
+        Chain of the i-th trade date as column arrays with per-day symbol and contract indexes
+        """
+        return DayChain.from_store(self.store, i)
+
+    def view(self, start_date=None, end_date=None, call_put: Optional[str] = None, max_expiration=None,
+             columns: Optional[List[str]] = None) -> ChainView:
+        """
+        Pruned view of the chain: trade dates within [start_date, end_date], ``call_put`` ('C' or 'P') options only,
+        expirations up to ``max_expiration`` (a date or day ordinal) and the given columns. Unset predicates keep all
+        """
+        store = self.store
+        lo, hi = store.day_range(-np.inf if start_date is None else ChainStore.ordinal(start_date),
+                                 np.inf if end_date is None else ChainStore.ordinal(end_date))
+        if max_expiration is not None and not isinstance(max_expiration, (int, np.integer)):
+            max_expiration = ChainStore.ordinal(max_expiration)
+        return ChainView(store, lo, hi, call_put, max_expiration, columns)
+
+    def quality_report(self, start_date=None, end_date=None) -> pd.DataFrame:
+        """
+        Per trade date, rows and rows with each quote problem (below intrinsic, crossed, zero bid, missing side)
+        """
+        return quality_report(self.view(start_date, end_date))
+
+    def build_surface(self, processes: Optional[int] = None) -> int:
+        """
+        Precompute the IV/Greeks surface of the trade dates that do not have it yet
+        """
+        store = self.store
+        self.surface = True
+        return build_surface(store, processes)
+
+    def ingest(self, fp, chunksize: int = CHUNK_ROWS) -> int:
+        """
+        Append the trade dates of another raw file (e.g. a daily drop) that the store does not have yet. The store
+        keeps the fingerprint of its own raw file
+        :return: Number of trade dates added
+        """
+        with self._lock:
+            store = self.store
+            added = ingest_chunks(store, read_raw(fp, chunksize))
+            if added:
+                if self.surface:
+                    build_surface(store)
+                self._frame = None
+                self._dates = None
+        return len(added)
+
+    def refresh(self):
+        """
+        Rebuild the store from the raw file regardless of its fingerprint
+        """
+        with self._lock:
+            self._store = self._build()
+            if self.surface:
+                build_surface(self._store)
+            self._frame = None
+            self._dates = None
+
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+DEFAULT_UNDERLYING = 'SPX'
+# Underlying -> (raw file, store) of its chain
+_registry: Dict[str, Tuple[str, str]] = {DEFAULT_UNDERLYING: (RAW_CSV_FP, STORE_FP)}
+
+
+def get_dataset(csv_fp: str = RAW_CSV_FP, store_fp: str = STORE_FP) -> Dataset:
+    """
+    Process-wide shared handle for the given files. Cheap: does not touch the disk
+    """
+    key = (os.path.abspath(csv_fp), os.path.abspath(store_fp))
+    with _datasets_lock:
+        if key not in _datasets:
+            _datasets[key] = Dataset(csv_fp, store_fp)
+        return _datasets[key]
+
+
+def register_underlying(underlying: str, csv_fp: str, store_fp: Optional[str] = None):
+    """
+    Map an underlying to its raw file and store. Nothing is read until a backtest on it first needs the data
+    :param store_fp: Defaults to the raw file's path without its extension, suffixed with _store
+    """
+    if store_fp is None:
+        store_fp = os.path.splitext(csv_fp)[0] + '_store'
+    with _datasets_lock:
+        _registry[underlying] = (csv_fp, store_fp)
+
+
+def registry() -> Dict[str, Tuple[str, str]]:
+    """
+    Underlying -> (raw file, store) of every registered underlying
+    """
+    with _datasets_lock:
+        return dict(_registry)
+
+
+def dataset_for(underlying: Optional[str] = None) -> Dataset:
+    """
+    Shared handle on the chain of ``underlying``, DEFAULT_UNDERLYING when not given. Handles open their store lazily
+    and read it through memory maps, so any number of underlyings can be held at once
+    """
+    underlying = DEFAULT_UNDERLYING if underlying is None else underlying
+    with _datasets_lock:
+        assert underlying in _registry, f"Unknown underlying {underlying}, see register_underlying"
+        csv_fp, store_fp = _registry[underlying]
+    return get_dataset(csv_fp, store_fp)
+
+
+def resolve_dataset(dataset: Union[str, Dataset, None]) -> Dataset:
+    """
+    Dataset handle from a handle, a registered underlying or None for the default underlying
+    """
+    return dataset if isinstance(dataset, Dataset) else dataset_for(dataset)
+
+
+def load_and_preprocess(refresh=False, surface=False, underlying: Optional[str] = None) -> pd.DataFrame:
+    """
+    :param surface: Also precompute the IV/Greeks surface, so backtests look Greeks up instead of solving them
+    :param underlying: Registered underlying to load, DEFAULT_UNDERLYING when not given
+    """
+    dataset = dataset_for(underlying)
+    if refresh:
+        dataset.refresh()
+    if surface:
+        dataset.build_surface()
+    return dataset.frame
@@ -0,0 +1,123 @@
+from req_import import *
+
+
+class EventSink:
+    """
+    Receives the events of a backtest: trades (entry/exit/expiry), below-intrinsic repricing, daily per-leg marks and
+    daily portfolio totals. The base sink is silent and ``enabled`` is False, so the backtest skips building events
+    altogether. Sinks are only handed raw values and format nothing unless they choose to
+    """
+    enabled = False
+
+    def day_start(self, date, underlying):
+        pass
+
+    def trade(self, kind: Literal['entry', 'exit', 'expiry'], date, position, symbol: str, price: float):
+        pass
+
+    def below_intrinsic(self, date, position, symbol: str, S, K, t, r, price, ask):
+        pass
+
+    def mark(self, date, leg: int, position, shares, stats: dict):
+        pass
+
+    def day_end(self, date, stats: dict):
+        pass
+
+
+class BlotterSink(EventSink):
+    """
+    Buffers every event in memory, one list per column, until exported as frames
+    """
+    enabled = True
+    _TABLES = {'trades': ('kind', 'date', 'position', 'buy_sell', 'symbol', 'price'),
+               'repricing': ('date', 'position', 'symbol', 'S', 'K', 't', 'r', 'mid', 'ask'),
+               'marks': ('date', 'leg', 'symbol', 'buy_sell', 'shares', 'value', 'PnL', 'iv', 'delta', 'gamma',
+                         'theta', 'vega'),
+               'days': ('date', 'SPX', 'PnL', 'iv', 'delta', 'gamma', 'theta', 'vega')}
+
+    def __init__(self):
+        self._columns = {table: {col: [] for col in cols} for table, cols in self._TABLES.items()}
+        self._underlying = None
+
+    def _append(self, table, *values):
+        for buffer, value in zip(self._columns[table].values(), values):
+            buffer.append(value)
+
+    def day_start(self, date, underlying):
+        self._underlying = underlying
+
+    def trade(self, kind, date, position, symbol, price):
+        self._append('trades', kind, date, position.label, position.buy_sell, symbol, price)
+
+    def below_intrinsic(self, date, position, symbol, S, K, t, r, price, ask):
+        self._append('repricing', date, position.label, symbol, S, K, t, r, price, ask)
+
+    def mark(self, date, leg, position, shares, stats):
+        self._append('marks', date, leg, position.active_position, position.buy_sell, shares, stats['value'],
+                     stats['PnL'], stats['iv'], stats['delta'], stats['gamma'], stats['theta'], stats['vega'])
+
+    def day_end(self, date, stats):
+        self._append('days', date, self._underlying, stats['PnL'], stats['iv'], stats['delta'], stats['gamma'],
+                     stats['theta'], stats['vega'])
+
+    def to_frame(self, table: Literal['trades', 'repricing', 'marks', 'days']) -> pd.DataFrame:
+        return pd.DataFrame(self._columns[table])
+
+    def to_frames(self) -> Dict[str, pd.DataFrame]:
+        return {table: self.to_frame(table) for table in self._TABLES}
+
+    def to_csv(self, directory):
+        """
+        Write one csv per table into ``directory``
+        """
+        os.makedirs(directory, exist_ok=True)
+        for table, df in self.to_frames().items():
+            df.to_csv(os.path.join(directory, f"{table}.csv"), index=False)
+
+    def clear(self):
+        for cols in self._columns.values():
+            for buffer in cols.values():
+                buffer.clear()
+
+
+class ConsoleSink(EventSink):
+    """
+    Human-readable backtest log on stdout, worded like the former print log. Unlike it, a leg's marks are printed once
+    every leg has traded for the day, and only for legs held at the close: on entry days, not on exit or expiry days
+    """
+    enabled = True
+    _VERBS = {'entry': 'Entering', 'exit': 'Exiting', 'expiry': 'Expiring'}
+
+    def day_start(self, date, underlying):
+        print(date)
+        print("SPX Price: ", underlying)
+
+    def trade(self, kind, date, position, symbol, price):
+        print(f"{self._VERBS[kind]} position {position.buy_sell} {symbol} at px={price}")
+
+    def below_intrinsic(self, date, position, symbol, S, K, t, r, price, ask):
+        print(f"Below intrinsic: {symbol} {position.call_put} {S} {K} {t} {r} {price}")
+        print("Setting price to ask")
+
+    def mark(self, date, leg, position, shares, stats):
+        if position.active_position is None:
+            return
+        b_s_multiplier = 1 if position.buy_sell == 'Buy' else -1
+        print(f"Security {position}:")
+        print(f"\tNumber of Shares: {shares} {'long' if position.buy_sell=='Buy' else 'short'}\n",
+              f"\tCumulative PnL per Share: {stats['PnL']}",
+              f"\tIV per Share: {stats['iv']}",
+              f"\tDelta per Share: {stats['delta'] * b_s_multiplier}",
+              f"\tGamma per Share: {stats['gamma'] * b_s_multiplier}",
+              f"\tVega per Share: {stats['vega'] * b_s_multiplier}",
+              f"\tTheta per Share: {stats['theta'] * b_s_multiplier}",)
+
+    def day_end(self, date, stats):
+        print(f"Cumulative Total PnL: {stats['PnL']}")
+        print(f"Total IV: {stats['iv']}")
+        print(f"Total Delta: {stats['delta']}")
+        print(f"Total Gamma: {stats['gamma']}")
+        print(f"Total Theta: {stats['theta']}")
+        print(f"Total Vega: {stats['vega']}")
+        print("\n")
@@ -1,11 +1,11 @@
 from req_import import *
+from black_scholes import implied_vol, bs_price_and_greeks, IV_CONVERGED, IV_OUT_OF_BOUNDS
+from numpy import log, sqrt, exp
+from scipy.stats import norm
 N_prime = norm.pdf
 N = norm.cdf
 
 class OptionFromPrice():
-    _MAX_TRY = 1000
-    _ONE_CENT = 0.01
-
     @validate_call
     def __init__(
         self, c_p: Literal['C', 'P'], asset_price, option_market_price, strike_price,
@@ -26,63 +26,68 @@ class OptionFromPrice():
         return S * N_prime(d1) * sqrt(t)
 
     @staticmethod
-    def _vega_d1(S, d1, t):
-        return S * N_prime(d1) * sqrt(t)
+    def implied_vols(c_p, S, K, r, t, market_price):
+        """
+        Batch implied vols over arrays of options
+        :return: (vols, status) with the per-option status codes of black_scholes.implied_vol
+        """
+        return implied_vol(c_p, S, K, t, r, market_price, return_status=True)
 
     def find_iv_newton(self, S, K, r, t, market_price):
-        best_guess = np.inf
-        sigma_guess = 0.2
-        for i in range(OptionFromPrice._MAX_TRY):
-            if self.c_p == 'C':
-                bs_price = EuropeanCall.call_price(S, sigma_guess, K, t, r)
-            else:
-                bs_price = EuropeanPut.put_price(S, sigma_guess, K, t, r)
-            diff = market_price - bs_price
-            if abs(diff) < abs(market_price - best_guess):
-                best_guess = bs_price
-            if abs(diff) < OptionFromPrice._ONE_CENT:
-                return sigma_guess
-            d1 = (log(S / K) + (r + sigma_guess ** 2 / 2) * t) / (sigma_guess * sqrt(t))
-            vega = OptionFromPrice._vega_d1(S, d1, t)
-            sigma_guess += diff / vega
-        return bs_price
-
-class EuropeanCall():
-    @staticmethod
-    def call_price(S, sigma, K, t, r=0):
-        b = exp(-r * t)#.astype('float')
-        d1 = log(S / (b * K)) + (((sigma ** 2) * t) / 2)
-        d1 = d1 / (sigma * sqrt(t))
-        d2 = np.log(S / (b * K)) - ((sigma ** 2) * t) / 2
-        d2 = d2 / (sigma * (t ** .5))
-        z1 = N(d1) * S
-        z2 = ((b * K) * N(d2))
-        return z1 - z2
-
+        sigma, status = self.implied_vols(self.c_p, S, K, r, t, market_price)
+        if status == IV_OUT_OF_BOUNDS:
+            raise ValueError(f"Price {market_price} is outside the no-arbitrage bounds of {self.c_p} K={K}")
+        if status != IV_CONVERGED:
+            raise ValueError(f"Implied vol did not converge for {self.c_p} K={K} t={t} px={market_price}")
+        return float(sigma)
+
+class _EuropeanOption():
+    _FLAG = None
+
+    @classmethod
+    def batch(cls, S, sigma, K, t, r=0) -> Dict[str, np.ndarray]:
+        """
+        Price and Greeks of arrays of options in one vectorized call, from the analytic closed forms. Same conventions
+        as the instance attributes: vega and rho per point, theta per day. gamma, vanna and volga are also returned
+        """
+        return bs_price_and_greeks(cls._FLAG, S, K, t, r, sigma)
 
     def __init__(
         self, inputs
             ):
-
         self.asset_price = inputs[0]
         self.asset_volatility = inputs[1]
         self.strike_price = inputs[2]
         self.time_to_expiration = inputs[3]
         self.risk_free_rate = inputs[4]
-        self.price = self.call_price(self.asset_price, self.asset_volatility, self.strike_price,
-                                     self.time_to_expiration, self.risk_free_rate)
-
-        self.gradient_func = grad(self.call_price, (0, 1, 3))
-        self.delta, self.vega, self.theta = self.gradient_func(inputs[0], inputs[1], inputs[2], inputs[3], inputs[4])
-        self.theta /= -365
-        self.vega /= 100
+        greeks = self.batch(*inputs)
+        self.price = float(greeks['price'])
+        self.delta, self.vega, self.theta = float(greeks['delta']), float(greeks['vega']), float(greeks['theta'])
+        self.gamma, self.rho = float(greeks['gamma']), float(greeks['rho'])
 
     @property
     def _greeks(self):
         return self.delta, self.vega, self.theta
 
 
-class EuropeanPut():
+class EuropeanCall(_EuropeanOption):
+    _FLAG = 'c'
+
+    @staticmethod
+    def call_price(S, sigma, K, t, r=0):
+        b = exp(-r * t)#.astype('float')
+        d1 = log(S / (b * K)) + (((sigma ** 2) * t) / 2)
+        d1 = d1 / (sigma * sqrt(t))
+        d2 = np.log(S / (b * K)) - ((sigma ** 2) * t) / 2
+        d2 = d2 / (sigma * (t ** .5))
+        z1 = N(d1) * S
+        z2 = ((b * K) * N(d2))
+        return z1 - z2
+
+
+class EuropeanPut(_EuropeanOption):
+    _FLAG = 'p'
+
     @staticmethod
     def put_price(S, sigma, K, t, r=0):
         b = exp(-r * t)#.astype('float')
@@ -94,22 +99,6 @@ class EuropeanPut():
         z2 = S * N(d2)
         return z1 - z2
 
-    def __init__(
-        self, inputs
-            ):
-        self.asset_price = inputs[0]
-        self.asset_volatility = inputs[1]
-        self.strike_price = inputs[2]
-        self.time_to_expiration = inputs[3]
-        self.risk_free_rate = inputs[4]
-        self.price = self.put_price(self.asset_price, self.asset_volatility, self.strike_price, self.time_to_expiration,
-                                    self.risk_free_rate)
-
-        self.gradient_func = grad(self.put_price, (0, 1, 3)) #strike price, risk_free_rate does not change
-        self.delta, self.vega, self.theta = self.gradient_func(inputs[0], inputs[1], inputs[2], inputs[3], inputs[4])
-        self.theta /= -365
-        self.vega /= 100
-
 
 #Usage: def __init__(
 #        self, c_p: Literal['C', 'P'], asset_price, option_market_price, strike_price,
@@ -119,8 +108,8 @@ class EuropeanPut():
 if __name__=='__main__':
     call = OptionFromPrice(c_p='C',
                   asset_price=3932.59,
-                  option_market_price=10,
-                  strike_price=105,
+                  option_market_price=320,
+                  strike_price=3900,
                   time_to_expiration=365/365,
                   risk_free_rate=0.00)
 
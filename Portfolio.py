@@ -1,12 +1,32 @@
 from req_import import *
 from helpers import *
+from Dataset import *
 from Position import *
+from PositionBook import PositionBook
+from compiled import STATS, resolve_legs, leg_paths, aggregate
+from attribution import attribute
+from EventSink import EventSink, BlotterSink, ConsoleSink
+from StageTimer import StageTimer, StageProfiler
+from ResultCache import ResultCache
+from ChainStore import SURFACE_COLUMNS
+
+# Chain columns the per-day engines read, besides the precomputed IV and Greeks
+_DAY_COLUMNS = ['adjusted_close', 'strike', 'expiration', 'call_put', 'bid', 'ask', 'pricing_mid', 'quote_flags',
+                'option_symbol']
 
 class Portfolio:
-    _min_date = parse_date('2021-02-01')
-    _max_date = parse_date('2021-04-30')
-    data = load_and_preprocess(refresh=True)
-    _valid_date_list = data['date'].unique()
+    # Bump whenever the snapshot layout changes
+    SNAPSHOT_VERSION = 1
+    # Results of past backtests, served again when an identical portfolio is rerun on unchanged data. Memory only by
+    # default, set ResultCache(directory) to keep them across sessions or None to disable
+    result_cache: Optional[ResultCache] = ResultCache()
+
+    @classproperty
+    def data(cls) -> pd.DataFrame:
+        """
+        The whole dataset of the default underlying in memory. A portfolio only needs its ``data_view``
+        """
+        return dataset_for().frame
 
     @staticmethod
     def validate_positions(value: Any) -> Any:
@@ -22,63 +42,340 @@ class Portfolio:
     def __init__(self,
                  start_date: str,
                  end_date: str,
-                 positions: List[Position],
-                 shares: Optional[List[int]] = None):
+                 positions: Union[List[Position], PositionBook],
+                 shares: Optional[List[int]] = None,
+                 dataset: Union[str, Dataset, None] = None):
         """
 
-        :param positions: A list of positions
+        :param positions: A list of positions, or a PositionBook whose shares are used unless given
+        :param dataset: Registered underlying or dataset handle to backtest on. Defaults to that of the positions, which
+                        must all share it
         """
+        if isinstance(positions, PositionBook):
+            shares = positions.shares.tolist() if shares is None else shares
+            positions = positions.positions()
+        self.validate_positions(positions)
+        self.dataset = positions[0].dataset if dataset is None else resolve_dataset(dataset)
+        assert all(p.dataset is self.dataset for p in positions), "Positions must use the portfolio's dataset"
         self.start_date = parse_date(start_date)
         self.end_date = parse_date(end_date)
-        assert self._min_date <= self.start_date < self.end_date <= self._max_date, \
+        assert self.dataset.min_date <= self.start_date < self.end_date <= self.dataset.max_date, \
             "Start/End dates must be within range and sd<ed"
-        self.validate_positions(positions)
         self.position_list = positions
         if shares is None:
             shares = [1] * len(positions)
         assert len(shares) == len(positions)
         assert all([s > 0 for s in shares]), "Shares must be positive. For short, use position init"
         self.shares_list = shares
+        # Incremental state of ``advance``: the last trade date processed and the daily stats up to it
+        self.last_date: Optional[pd.Timestamp] = None
+        self.history: List[dict] = []
 
-    def run_backtest(self):
-        all_days = []
-        for d in self._valid_date_list:
-            d = pd.to_datetime(d)
-            if self.start_date > d or self.end_date < d:
-                continue
-
-            data_slice = self.data.query("date == @d")
-            print(d)
-            print("SPX Price: ", data_slice['adjusted_close'].values[0])
-            daily_stats = {'date': d, 'SPX': data_slice['adjusted_close'].values[0], 'PnL': 0, 'iv': 0, 'delta': 0, 'gamma': 0, 'theta': 0, 'vega': 0}
-            for p, s in zip(self.position_list, self.shares_list):
-                if p.active_position is not None: print(f"Security {p}:")
-                stats = p.process_date(d, data_slice)
-                b_s_multiplier = 1 if p.buy_sell == 'Buy' else -1
-                if p.active_position is not None:
-                    print(f"\tNumber of Shares: {s} {'long' if p.buy_sell=='Buy' else 'short'}\n",
-                          f"\tCumulative PnL per Share: {stats['PnL']}",
-                          f"\tIV per Share: {stats['iv']}",
-                          f"\tDelta per Share: {stats['delta'] * b_s_multiplier}",
-                          f"\tGamma per Share: {stats['gamma'] * b_s_multiplier}",
-                          f"\tVega per Share: {stats['vega'] * b_s_multiplier}",
-                          f"\tTheta per Share: {stats['theta'] * b_s_multiplier}",)
-                daily_stats['PnL'] += s * (stats['PnL'])
-                daily_stats['iv'] += s * (stats['iv'] ** 2)
-                daily_stats['delta'] += s * (stats['delta']) * b_s_multiplier
-                daily_stats['gamma'] += s * (stats['gamma']) * b_s_multiplier
-                daily_stats['theta'] += s * (stats['theta']) * b_s_multiplier
-                daily_stats['vega'] += s * (stats['vega']) * b_s_multiplier
-            daily_stats['iv'] = np.sqrt(daily_stats['iv'])
-
-            print(f"Cumulative Total PnL: {daily_stats['PnL']}")
-            print(f"Total IV: {daily_stats['iv']}")
-            print(f"Total Delta: {daily_stats['delta']}")
-            print(f"Total Gamma: {daily_stats['gamma']}")
-            print(f"Total Theta: {daily_stats['theta']}")
-            print(f"Total Vega: {daily_stats['vega']}")
-            print("\n")
-            all_days.append(daily_stats)
-        all_days = pd.DataFrame(all_days)
+    def _max_expiration(self, lo, hi) -> Optional[int]:
+        """
+        Latest expiration any position can hold: the relative_expiration_months-th expiration listed on its entry date
+        """
+        store, bound = self.dataset.store, None
+        for p in self.position_list:
+            e = int(np.searchsorted(store.dates, ChainStore.ordinal(p.entry_date)))
+            if not lo <= e < hi or store.dates[e] != ChainStore.ordinal(p.entry_date):
+                return None  # The backtest rejects the position. Let it do so on unpruned data
+            expirations = np.unique(store.partition(e, ['expiration'])['expiration'])
+            if len(expirations) < p.relative_expiration_months:
+                return None
+            bound = max(bound or 0, int(expirations[p.relative_expiration_months - 1]))
+        return bound
+
+    def data_view(self, columns: Optional[List[str]] = None) -> ChainView:
+        """
+        The part of the dataset this portfolio can touch: trade dates of its window, only the option type of its
+        positions when they share one, and expirations no later than the furthest one its positions select
+        :param columns: Columns to keep, all by default
+        """
+        lo, hi = self.dataset.day_range(self.start_date, self.end_date)
+        call_put = {p.call_put[0] for p in self.position_list}
+        return ChainView(self.dataset.store, lo, hi, call_put.pop() if len(call_put) == 1 else None,
+                         self._max_expiration(lo, hi), columns)
+
+    def _day_columns(self, lo, hi) -> List[str]:
+        """
+        Chain columns the per-day engines read on trade dates [lo, hi): _DAY_COLUMNS, plus the precomputed IV and
+        Greeks when all those dates have them
+        """
+        use_surface = set(self.dataset.store.missing(SURFACE_COLUMNS.values())).isdisjoint(range(lo, hi))
+        return _DAY_COLUMNS + (list(SURFACE_COLUMNS.values()) if use_surface else [])
+
+    def run_backtest(self, engine: Literal['loop', 'compiled', 'stream'] = 'loop', sink: Optional[EventSink] = None,
+                     profiler: Optional[StageTimer] = None, use_cache: bool = True, read_ahead: int = 2,
+                     attribution: bool = False):
+        """
+        :param engine: 'loop' walks the positions day by day. 'compiled' resolves every position up front and computes
+                        all days of all legs with vectorized array operations. 'stream' is the loop over days read
+                        from disk by a background thread, for chains larger than memory. Same output
+        :param sink: Receives entries, exits, expiries, repricing, per-leg marks and daily totals of the 'loop' and
+                        'stream' engines. Silent by default. ConsoleSink prints them, BlotterSink buffers them as tables
+        :raises ValueError: With an enabled sink and the 'compiled' engine, which emits no events
+        :param profiler: Times the stages of the run, e.g. StageProfiler(cprofile=True). The timings are also
+                            attached to the result as ``result.attrs['timings']``
+        :param use_cache: Look the result up in ``result_cache`` and store it there. Runs with an enabled sink or a
+                            profiler are always computed, their events and timings being the point, but still stored
+        :param read_ahead: Days the 'stream' engine reads ahead of the one being processed
+        :param attribution: Add the daily PnL split into delta, gamma, theta and vega contributions and an
+                            unexplained residual (see attribution.py), from the per-leg stats the engine computed. Such
+                            runs are always computed, and stored without these columns
+        """
+        if engine == 'compiled' and sink is not None and sink.enabled:
+            raise ValueError("The compiled engine emits no events. Use the 'loop' or 'stream' engine with a sink")
+        cache = self.result_cache if use_cache else None
+        if cache is not None:
+            key = cache.key(self)
+            if (sink is None or not sink.enabled) and profiler is None and not attribution:
+                result = cache.get(key)
+                if result is not None:
+                    return result
+
+        timer = StageTimer() if profiler is None else profiler
+        timer.start()
+        try:
+            if engine == 'compiled':
+                result, paths = self._run_compiled(timer)
+            else:
+                result, paths = self._run_positions(sink, timer, read_ahead if engine == 'stream' else None,
+                                                    attribution)
+            if attribution:
+                with timer.stage('attribution'):
+                    attributed = attribute(paths)
+        finally:
+            timer.stop()
+        if cache is not None:
+            cache.put(key, result)
+        if attribution:
+            result = result.assign(**attributed.drop(columns='date'))
+        if timer.enabled:
+            result.attrs['timings'] = timer.to_frame()
+        return result
+
+    def _run_compiled(self, timer: StageTimer) -> Tuple[pd.DataFrame, dict]:
+        """
+        :return: The daily stats and the leg paths they were aggregated from
+        """
+        with timer.stage('resolve_legs'):
+            resolved = resolve_legs(self)
+        with timer.stage('leg_paths'):
+            paths = leg_paths(self, resolved)
+        with timer.stage('aggregate'):
+            return aggregate(paths), paths
+
+    @contextlib.contextmanager
+    def _attached(self, sink: EventSink, timer: StageTimer):
+        for p in self.position_list:
+            p.sink = sink
+            p.timer = timer
+        try:
+            yield
+        finally:
+            for p in self.position_list:
+                p.sink = Position.sink
+                p.timer = Position.timer
+
+    def _run_positions(self, sink: Optional[EventSink], timer: StageTimer, read_ahead: Optional[int] = None,
+                       collect: bool = False) -> Tuple[pd.DataFrame, Optional[dict]]:
+        sink = EventSink() if sink is None else sink
+        # A backtest replays from start_date, leaving any state carried by ``advance`` as it was
+        states = [p.state() for p in self.position_list]
         self.reset_positions()
-        return all_days
\ No newline at end of file
+        try:
+            with self._attached(sink, timer):
+                return self._run_loop(sink, timer, read_ahead, collect)
+        finally:
+            for p, state in zip(self.position_list, states):
+                p.restore(state)
+
+    def _run_loop(self, sink: EventSink, timer: StageTimer, read_ahead: Optional[int] = None,
+                  collect: bool = False) -> Tuple[pd.DataFrame, Optional[dict]]:
+        """
+        :param read_ahead: Stream the days from disk with that read-ahead rather than reading the memory-mapped store
+        :param collect: Also keep the per-leg stats of every day
+        :return: The daily stats, and with ``collect`` the leg paths in the layout of compiled.leg_paths
+        """
+        all_days = []
+        leg_days = [] if collect else None
+        view = self.data_view(self._day_columns(*self.dataset.day_range(self.start_date, self.end_date)))
+        if read_ahead is None:
+            days = ((i, view.chain(i)) for i in range(view.lo, view.hi))
+        else:
+            days = view.stream(read_ahead)
+        with contextlib.closing(days):
+            for i in range(view.lo, view.hi):
+                d = pd.Timestamp(self.dataset.dates[i])
+                timer.day_start(d)
+                with timer.stage('chain'):
+                    _, data_slice = next(days)
+                all_days.append(self._process_day(d, data_slice, sink, timer, leg_days=leg_days))
+        result = pd.DataFrame(all_days)
+        return result, None if leg_days is None else self._leg_paths(result, leg_days)
+
+    def _leg_paths(self, result: pd.DataFrame, leg_days: List[tuple]) -> dict:
+        """
+        (legs, days) matrices of the per-leg stats and active flags ``_process_day`` collected
+        """
+        n_legs, n_days = len(self.position_list), len(leg_days)
+        paths = {stat: np.array([[s[stat] for s in all_stats] for all_stats, _ in leg_days], dtype=float).T
+                 .reshape(n_legs, n_days) for stat in STATS}
+        paths['active'] = np.zeros((n_legs, n_days), dtype=bool)
+        for j, (_, active) in enumerate(leg_days):
+            paths['active'][active, j] = True
+        paths['dates'] = result['date'].to_numpy() if n_days else np.array([], dtype='datetime64[ns]')
+        paths['SPX'] = result['SPX'].to_numpy(dtype=float) if n_days else np.zeros(0)
+        paths['legs'] = {'sign': np.array([1. if p.buy_sell == 'Buy' else -1. for p in self.position_list]),
+                         'shares': np.asarray(self.shares_list, dtype=float)}
+        return paths
+
+    def _process_day(self, d: pd.Timestamp, data_slice: DayChain, sink: EventSink, timer: StageTimer,
+                     open_ended: bool = False, leg_days: Optional[List[tuple]] = None) -> dict:
+        """
+        :param leg_days: Receives the day's per-leg stats and the indices of the legs held at the close
+        """
+        if sink.enabled:
+            sink.day_start(d, data_slice.underlying)
+        daily_stats = {'date': d, 'SPX': data_slice.underlying, 'PnL': 0, 'iv': 0, 'delta': 0, 'gamma': 0, 'theta': 0, 'vega': 0}
+        all_stats = []
+        for p in self.position_list:
+            with timer.stage('process_date', p):
+                all_stats.append(p.process_date(d, data_slice, greeks=False, open_ended=open_ended))
+        # Price every active leg of the day in one vectorized pass
+        active = [k for k, p in enumerate(self.position_list) if p.active_position is not None]
+        if active:
+            with timer.stage('iv_greeks'):
+                inputs = np.array([self.position_list[k]._pricing_inputs(data_slice) for k in active])
+                if data_slice.has_surface:
+                    rows = [data_slice.symbol_row(self.position_list[k].active_position) for k in active]
+                    leg_greeks = data_slice.surface(rows)
+                else:
+                    leg_greeks = iv_and_greeks([self.position_list[k]._vol_flag for k in active], *inputs.T)
+                for j, k in enumerate(active):
+                    all_stats[k]['value'] = inputs[j, -1]
+                    all_stats[k].update({g: float(v[j]) for g, v in leg_greeks.items()})
+
+        for k, (p, s, stats) in enumerate(zip(self.position_list, self.shares_list, all_stats)):
+            if sink.enabled:
+                with timer.stage('sink', p):
+                    sink.mark(d, k, p, s, stats)
+            b_s_multiplier = 1 if p.buy_sell == 'Buy' else -1
+            daily_stats['PnL'] += s * (stats['PnL'])
+            daily_stats['iv'] += s * (stats['iv'] ** 2)
+            daily_stats['delta'] += s * (stats['delta']) * b_s_multiplier
+            daily_stats['gamma'] += s * (stats['gamma']) * b_s_multiplier
+            daily_stats['theta'] += s * (stats['theta']) * b_s_multiplier
+            daily_stats['vega'] += s * (stats['vega']) * b_s_multiplier
+        daily_stats['iv'] = np.sqrt(daily_stats['iv'])
+        if leg_days is not None:
+            leg_days.append((all_stats, active))
+
+        if sink.enabled:
+            with timer.stage('sink'):
+                sink.day_end(d, daily_stats)
+        return daily_stats
+
+    def _next_day(self) -> int:
+        """
+        Index into the dataset's trade dates of the first one ``advance`` has not processed yet
+        """
+        first = self.start_date if self.last_date is None else self.last_date + pd.Timedelta(days=1)
+        return int(np.searchsorted(self.dataset.store.dates, ChainStore.ordinal(first)))
+
+    def advance(self, raw_fp: Optional[str] = None, sink: Optional[EventSink] = None) -> Optional[dict]:
+        """
+        Process the next trade date after ``last_date`` (start_date when nothing was processed yet), carrying the
+        positions' state forward. Only that day's chain is read. Positions without an exit date are held on, not closed
+        on the dataset's last trade date as in ``run_backtest``
+        :param raw_fp: Raw file of new trade dates (e.g. today's drop) ingested into the dataset first
+        :param sink: Receives the day's events like in ``run_backtest``
+        :return: The day's stats, also appended to ``history``. None when the dataset has no later trade date
+        """
+        if raw_fp is not None:
+            self.dataset.ingest(raw_fp)
+        i = self._next_day()
+        if i == len(self.dataset.store):
+            return None
+        call_put = {p.call_put[0] for p in self.position_list}
+        view = ChainView(self.dataset.store, i, i + 1, call_put.pop() if len(call_put) == 1 else None,
+                         columns=self._day_columns(i, i + 1))
+        return self._advance(i, view.chain(i), sink)
+
+    def advance_to(self, date, sink: Optional[EventSink] = None) -> pd.DataFrame:
+        """
+        ``advance`` through every trade date up to ``date``, e.g. to catch up from start_date before the first snapshot
+        :return: ``history_frame()``
+        """
+        lo = self._next_day()
+        hi = self.dataset.store.day_range(-np.inf, ChainStore.ordinal(date))[1]
+        if lo < hi:
+            call_put = {p.call_put[0] for p in self.position_list}
+            view = ChainView(self.dataset.store, lo, hi, call_put.pop() if len(call_put) == 1 else None,
+                             self._max_expiration(lo, hi) if self.last_date is None else None,
+                             self._day_columns(lo, hi))
+            for i in range(lo, hi):
+                self._advance(i, view.chain(i), sink)
+        return self.history_frame()
+
+    def _advance(self, i: int, data_slice: DayChain, sink: Optional[EventSink]) -> dict:
+        sink = EventSink() if sink is None else sink
+        d = pd.Timestamp(self.dataset.dates[i])
+        with self._attached(sink, Position.timer):
+            stats = self._process_day(d, data_slice, sink, Position.timer, open_ended=True)
+        self.history.append(stats)
+        self.last_date = d
+        return stats
+
+    def history_frame(self) -> pd.DataFrame:
+        """
+        Daily stats of every trade date ``advance`` processed, in the layout of ``run_backtest``
+        """
+        return pd.DataFrame(self.history)
+
+    def snapshot(self, fp):
+        """
+        Save the portfolio definition, the state of its positions and its ``history`` to ``fp`` as gzipped JSON.
+        ``from_snapshot`` picks up from there. The file is replaced atomically
+        """
+        history = self.history_frame()
+        state = {'version': self.SNAPSHOT_VERSION,
+                 'dataset': {'csv_fp': self.dataset.csv_fp, 'store_fp': self.dataset.store_fp},
+                 'start_date': self.start_date.strftime('%Y-%m-%d'),
+                 'end_date': self.end_date.strftime('%Y-%m-%d'),
+                 'shares': [float(s) for s in self.shares_list],
+                 'positions': [{'params': p.params(), 'state': p.state()} for p in self.position_list],
+                 'last_date': None if self.last_date is None else self.last_date.strftime('%Y-%m-%d'),
+                 # Column -> values, far more compact than one record per day
+                 'history': {c: history[c].dt.strftime('%Y-%m-%d').tolist() if c == 'date' else
+                             history[c].astype(float).tolist() for c in history.columns}}
+        tmp_fp = f"{fp}.tmp"
+        with gzip.open(tmp_fp, 'wt') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_fp, fp)
+
+    @classmethod
+    def from_snapshot(cls, fp, dataset: Union[str, Dataset, None] = None) -> 'Portfolio':
+        """
+        Portfolio saved by ``snapshot``, ready to ``advance``
+        :param dataset: Registered underlying or dataset handle. The raw file and store the snapshot was taken on by
+                        default
+        """
+        with gzip.open(fp, 'rt') as f:
+            state = json.load(f)
+        assert state['version'] == cls.SNAPSHOT_VERSION, f"Snapshot version {state['version']} is not supported"
+        if dataset is None:
+            dataset = get_dataset(state['dataset']['csv_fp'], state['dataset']['store_fp'])
+        dataset = resolve_dataset(dataset)
+        positions = [Position(**p['params'], dataset=dataset) for p in state['positions']]
+        for p, saved in zip(positions, state['positions']):
+            p.restore(saved['state'])
+        shares = [int(s) if float(s).is_integer() else s for s in state['shares']]
+        portfolio = cls(state['start_date'], state['end_date'], positions, shares, dataset)
+        portfolio.last_date = None if state['last_date'] is None else pd.Timestamp(state['last_date'])
+        history = pd.DataFrame(state['history'])
+        if 'date' in history:
+            history['date'] = pd.to_datetime(history['date'])
+        portfolio.history = history.to_dict('records')
+        return portfolio
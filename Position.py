@@ -2,20 +2,34 @@ import pandas as pd
 
 from req_import import *
 from helpers import *
+from ChainStore import DayChain
+from Dataset import Dataset, resolve_dataset
+from black_scholes import implied_vol, bs_price, bs_greeks, iv_and_greeks
+from EventSink import EventSink
+from StageTimer import StageTimer
+from quotes import BELOW_INTRINSIC
 
 class Position:
-    @validate_call
+    # Receives this position's trade and repricing events. Portfolio.run_backtest swaps in its own sink for the run
+    sink: EventSink = EventSink()
+    # Times this position's stages. Disabled unless Portfolio.run_backtest is given a profiler
+    timer: StageTimer = StageTimer()
+
+    @validate_call(config=dict(arbitrary_types_allowed=True))
     def __init__(self,
                  entry_date: str,
                  call_put: Literal['Call', 'Put'],
                  buy_sell: Literal['Buy', 'Sell'] = 'Buy',
                  entry_side: Literal['Far', 'Mid', 'Near'] = 'Far',
-                 relative_strike_pct: float = Field(None, ge=-1, le=1),
+                 relative_strike_pct: Optional[float] = Field(None, ge=-1, le=1),
                  relative_expiration_months: int = Field(None, ge=1),
                  mtm_side: Literal['Far', 'Mid', 'Near'] = 'Mid',
-                 exit_date: Optional[str] = None):
+                 exit_date: Optional[str] = None,
+                 target_delta: Optional[float] = Field(None, gt=0, lt=1),
+                 strike_tie: Literal['up', 'down', 'otm', 'itm'] = 'up',
+                 dataset: Union[str, Dataset, None] = None):
         """
-        This class is option position on SPX
+        This class is an option position on one underlying of the dataset registry
         :param entry_date: The date we buy the option
         :param call_put: Either 'C' or 'P'
         :param entry_side: The price at which we enter 'Near' is near touch, 'Mid' is midpoint and 'Far' is far touch
@@ -23,82 +37,166 @@ class Position:
         :param mtm_side: The price at which we mark-to-market. 'Near', 'Mid' or 'Far'
         :param exit_date: Date to exit the position (at the mtm_side). If the date is not provided or past expiration,
                             the option is held to expiration
+        :param target_delta: Absolute delta to select the strike by (e.g. 0.25), instead of relative_strike_pct
+        :param strike_tie: Strike taken when the target lies halfway between two listed ones: 'up', 'down', 'otm' or
+                            'itm'
+        :param dataset: Registered underlying (e.g. 'SPX') or dataset handle the position trades. Defaults to the
+                            default underlying
+        """
+        assert (relative_strike_pct is None) != (target_delta is None), \
+            "Select the strike by either relative_strike_pct or target_delta"
+        self._setup(parse_date(entry_date), call_put, buy_sell, entry_side, relative_strike_pct,
+                    relative_expiration_months, mtm_side, None if exit_date is None else parse_date(exit_date),
+                    target_delta, strike_tie, resolve_dataset(dataset))
+
+    @classmethod
+    def _trusted(cls, **fields) -> 'Position':
         """
-        self.entry_date = parse_date(entry_date)
+        Position from fields PositionBook already validated and parsed in bulk, skipping per-object validation
+        """
+        position = cls.__new__(cls)
+        position._setup(**fields)
+        return position
+
+    def _setup(self, entry_date, call_put, buy_sell, entry_side, relative_strike_pct, relative_expiration_months,
+               mtm_side, exit_date, target_delta, strike_tie, dataset: Dataset):
+        self.entry_date = entry_date
         self.call_put = call_put
         self.buy_sell = buy_sell
         self.entry_side = entry_side
         self.relative_strike_pct = relative_strike_pct
         self.relative_expiration_months = relative_expiration_months
         self.mtm_side = mtm_side
-        self.exit_date = parse_date(exit_date)
+        self._exit_date = exit_date
+        self.target_delta = target_delta
+        self.strike_tie = strike_tie
+        self.dataset = dataset
 
         self.active_position: Optional[str] = None
         self.active_position_expiry: Optional[datetime.date] = None
         self.entry_price: Optional[float] = None
         self.exit_price: Optional[float] = None
 
+    @property
+    def exit_date(self) -> datetime:
+        """
+        Exit date. The last trade date of the dataset, i.e. held to expiration, when none was given
+        """
+        if self._exit_date is None:
+            return self.dataset.max_date.to_pydatetime()
+        return self._exit_date
+
     def reset(self):
         self.active_position = None
         self.active_position_expiry = None
         self.entry_price = None
         self.exit_price = None
 
-    def _enter_position(self, curr_data):
-        underlying_px = curr_data['adjusted_close'].values[0]
+    def params(self) -> dict:
+        """
+        Constructor arguments of the position, dataset aside
+        """
+        return {'entry_date': self.entry_date.strftime('%Y-%m-%d'),
+                'call_put': self.call_put,
+                'buy_sell': self.buy_sell,
+                'entry_side': self.entry_side,
+                'relative_strike_pct': self.relative_strike_pct,
+                'relative_expiration_months': self.relative_expiration_months,
+                'mtm_side': self.mtm_side,
+                'exit_date': None if self._exit_date is None else self._exit_date.strftime('%Y-%m-%d'),
+                'target_delta': self.target_delta,
+                'strike_tie': self.strike_tie}
+
+    def state(self) -> dict:
+        """
+        What process_date carries from one trade date to the next, JSON serializable
+        """
+        return {'active_position': self.active_position,
+                'active_position_expiry': None if self.active_position_expiry is None else
+                self.active_position_expiry.strftime('%Y-%m-%d'),
+                'entry_price': None if self.entry_price is None else float(self.entry_price),
+                'exit_price': None if self.exit_price is None else float(self.exit_price)}
+
+    def restore(self, state: dict):
+        """
+        Pick up from a ``state()``
+        """
+        self.active_position = state['active_position']
+        expiry = state['active_position_expiry']
+        self.active_position_expiry = None if expiry is None else pd.Timestamp(expiry)
+        self.entry_price = state['entry_price']
+        self.exit_price = state['exit_price']
+
+    def _touch_price(self, side, bid, ask, opening: bool):
+        if side == 'Mid':
+            return (bid + ask) / 2
+        buying = (self.buy_sell == 'Buy') == opening
+        if side == 'Far':
+            return ask if buying else bid
+        return bid if buying else ask  # Near
+
+    def _select_contract(self, curr_data: DayChain) -> int:
+        assert len(curr_data.expirations) >= self.relative_expiration_months, "Not enough expirations listed"
+        expiration = curr_data.expirations[self.relative_expiration_months - 1]
+        if self.target_delta is not None:
+            return self._delta_row(curr_data, expiration)
+        underlying_px = curr_data.underlying
         strike = underlying_px * (
             1 - self.relative_strike_pct if self.call_put == 'Call' else 1 + self.relative_strike_pct)
-        strike = base_round(strike, base=5) #TODO: make this work for any K increment
-        expiration = curr_data.expiration.unique()[self.relative_expiration_months - 1]
-        option = curr_data.query("strike==@strike and expiration==@expiration and call_put==@self.call_put[0]")
-        assert len(option) == 1, "Multiple matching options"
-        option = option.to_dict('records')[0]
-
-        self.active_position = option['option_symbol']
-        self.active_position_expiry = pd.to_datetime(option['expiration'])
-        if self.entry_side == 'Mid':
-            self.entry_price = (option['ask'] + option['bid']) / 2
-        elif self.entry_side == 'Far':
-            self.entry_price = option['ask'] if self.buy_sell == 'Buy' else option['bid']
-        else:  # Near
-            self.entry_price = option['bid'] if self.buy_sell == 'Buy' else option['ask']
-
-        print(f"Entering position {self.buy_sell} {self.active_position} at px={self.entry_price}")
-
-    def _exit_position(self, curr_data):
-        option = curr_data.query("option_symbol == @self.active_position")
-        if self.entry_side == "Mid":
-            self.exit_price = (option['bid'] + option['ask']) / 2
-        elif self.entry_side == 'Far':
-            self.exit_price = option['bid'] if self.buy_sell == 'Buy' else option['ask']
-        else:  # Near
-            self.exit_price = option['ask'] if self.buy_sell == 'Buy' else option['bid']
-        self.exit_price = self.exit_price.iloc[0]
-        print(f"Exiting position {self.buy_sell} {self.active_position} at px={self.exit_price}")
+        return curr_data.nearest_strike_row(self.call_put[0], expiration, strike, self.strike_tie)
+
+    def _delta_row(self, curr_data: DayChain, expiration: int) -> int:
+        """
+        Row of the option of the expiration whose absolute delta is nearest target_delta
+        """
+        strikes, rows = curr_data.strike_ladder(self.call_put[0], expiration)
+        if curr_data.has_surface:
+            deltas = curr_data.surface(rows)['delta']
+        else:
+            S = curr_data['adjusted_close'][rows].astype(float)
+            t = (expiration - curr_data.ordinal) / 365
+            with np.errstate(all='ignore'):
+                deltas = iv_and_greeks(self._vol_flag, S, strikes, t, 0.00, curr_data['pricing_mid'][rows])['delta']
+        distance = np.abs(np.abs(deltas) - self.target_delta)
+        assert not np.isnan(distance).all(), "No option with a valid delta"
+        return int(rows[np.nanargmin(distance)])
+
+    def _enter_position(self, curr_data: DayChain):
+        with self.timer.stage('select_contract', self):
+            row = self._select_contract(curr_data)
+        self.active_position = curr_data.symbol(row)
+        self.active_position_expiry = curr_data.expiry(row)
+        self.entry_price = self._touch_price(self.entry_side, curr_data['bid'][row], curr_data['ask'][row],
+                                             opening=True)
+
+        if self.sink.enabled:
+            self.sink.trade('entry', curr_data.date, self, self.active_position, self.entry_price)
+
+    def _exit_position(self, curr_data: DayChain):
+        row = curr_data.symbol_row(self.active_position)
+        self.exit_price = self._touch_price(self.entry_side, curr_data['bid'][row], curr_data['ask'][row],
+                                            opening=False)
+        if self.sink.enabled:
+            self.sink.trade('exit', curr_data.date, self, self.active_position, self.exit_price)
         self.active_position = None
         self.active_position_expiry = None
 
-    def _expire_position(self, curr_data):
-        option = curr_data.query("option_symbol == @self.active_position")
-        self.exit_price = ((option['adjusted_close'] - option['strike']) * (1 if self.call_put == 'Call' else -1)).iloc[
-            0]
+    def _expire_position(self, curr_data: DayChain):
+        row = curr_data.symbol_row(self.active_position)
+        self.exit_price = (curr_data['adjusted_close'][row] - float(curr_data['strike'][row])) * \
+            (1 if self.call_put == 'Call' else -1)
         self.exit_price = max(0, self.exit_price)
-        print(f"Expiring position {self.buy_sell} {self.active_position} at px={self.exit_price}")
+        if self.sink.enabled:
+            self.sink.trade('expiry', curr_data.date, self, self.active_position, self.exit_price)
         self.active_position = None
         self.active_position_expiry = None
 
-    def _get_pnl(self, curr_data):
+    def _get_pnl(self, curr_data: DayChain):
         if self.active_position is None:
             mark_px = self.exit_price
         else:
-            option = curr_data.query("option_symbol == @self.active_position")
-            if self.mtm_side == "Mid":
-                mark_px = (option['bid'] + option['ask']) / 2
-            elif self.mtm_side == 'Far':
-                mark_px = option['bid'] if self.buy_sell == 'Buy' else option['ask']
-            else:  # Near
-                mark_px = option['ask'] if self.buy_sell == 'Buy' else option['bid']
-            mark_px = mark_px.iloc[0]
+            row = curr_data.symbol_row(self.active_position)
+            mark_px = self._touch_price(self.mtm_side, curr_data['bid'][row], curr_data['ask'][row], opening=False)
         pnl = (mark_px - self.entry_price) * (1 if self.buy_sell == 'Buy' else -1)
         return pnl
 
@@ -108,33 +206,50 @@ class Position:
             expiry_date = self.active_position_expiry
         return (expiry_date - curr_date).days
 
-    def _get_option_stats(self, curr_data):
-        pnl = self._get_pnl(curr_data)
-        if self.active_position is None:
-            return {'value': 0, 'PnL': pnl, 'iv': 0,'delta': 0, 'gamma': 0, 'theta': 0, 'vega': 0}
+    @property
+    def _vol_flag(self) -> str:
+        return 'c' if self.call_put == 'Call' else 'p'
 
-        option = curr_data.query("option_symbol == @self.active_position").to_dict('records')[0]
-        price = (option['bid'] + option['ask']) / 2
-        S = option['adjusted_close']
-        K = option['strike']
-        t = self._days_to_expiry(option['date']) / 365
+    def _pricing_inputs(self, curr_data: DayChain, row=None, expiry_date=None):
+        """
+        (S, K, t, r, price) of the active option, or of the option at ``row`` expiring on ``expiry_date``
+        """
+        if row is None:
+            row = curr_data.symbol_row(self.active_position)
+        price = curr_data['pricing_mid'][row]
+        S = float(curr_data['adjusted_close'][row])
+        K = float(curr_data['strike'][row])
+        t = self._days_to_expiry(curr_data.date, expiry_date) / 365
         r = 0.00
 
-        intrinsic = max(S - K, 0) if self.call_put == 'Call' else max(K - S, 0)
-        if price < intrinsic:
-            print(f"Below intrinsic: {self.active_position} {self.call_put} {S} {K} {t} {r} {price}")
-            print("Setting price to ask")
-            price = option['ask']
-
-        implied_vol = iv(price, S, K, t, r, 'c' if self.call_put == 'Call' else 'p')
-        implied_delta = delta('c' if self.call_put == 'Call' else 'p', S, K, t, r, implied_vol)
-        implied_gamma = gamma('c' if self.call_put == 'Call' else 'p', S, K, t, r, implied_vol)
-        implied_theta = theta('c' if self.call_put == 'Call' else 'p', S, K, t, r, implied_vol)
-        implied_vega = vega('c' if self.call_put == 'Call' else 'p', S, K, t, r, implied_vol)
-        return {'value': price, 'PnL': pnl, 'iv': implied_vol, 'delta': implied_delta, 'gamma': implied_gamma,
-                'theta': implied_theta, 'vega': implied_vega}
-
-    def process_date(self, dt: datetime.date, curr_data: pd.DataFrame):
+        if self.sink.enabled and curr_data['quote_flags'][row] & BELOW_INTRINSIC:
+            bid, ask = curr_data['bid'][row], curr_data['ask'][row]
+            self.sink.below_intrinsic(curr_data.date, self, curr_data.symbol(row), S, K, t, r, (bid + ask) / 2, ask)
+        return S, K, t, r, price
+
+    def _get_option_stats(self, curr_data: DayChain, greeks=True):
+        with self.timer.stage('mark', self):
+            pnl = self._get_pnl(curr_data)
+        if self.active_position is None or not greeks:
+            return {'value': 0, 'PnL': pnl, 'iv': 0,'delta': 0, 'gamma': 0, 'theta': 0, 'vega': 0}
+
+        S, K, t, r, price = self._pricing_inputs(curr_data)
+        with self.timer.stage('iv_greeks', self):
+            if curr_data.has_surface:
+                stats = curr_data.surface(curr_data.symbol_row(self.active_position))
+            else:
+                stats = iv_and_greeks(self._vol_flag, S, K, t, r, price)
+        return {'value': price, 'PnL': pnl, **{k: float(v) for k, v in stats.items()}}
+
+    def process_date(self, dt: datetime.date, curr_data: DayChain, greeks=True, open_ended=False):
+        """
+        :param greeks: When False, only the PnL is filled in and the caller prices the active option itself
+        :param open_ended: Without an exit date, keep holding on the dataset's last trade date rather than closing
+                            there. For runs advanced day by day, where the last trade date is just the latest one
+        """
+        if isinstance(curr_data, pd.DataFrame):
+            curr_data = DayChain.from_frame(curr_data)
+        exit_date = self._exit_date if open_ended else self.exit_date
         if self.active_position is None:
             if dt < self.entry_date:
                 return {'value': 0, 'PnL': 0, 'iv': 0,'delta': 0, 'gamma': 0, 'theta': 0, 'vega': 0}
@@ -145,55 +260,44 @@ class Position:
             self._enter_position(curr_data)
         elif dt == self.active_position_expiry:
             self._expire_position(curr_data)
-        elif dt == self.exit_date:
+        elif dt == exit_date:
             self._exit_position(curr_data)
         else:
-            assert dt > self.entry_date and dt < self.exit_date, "Invalid date for an active position!"
+            assert dt > self.entry_date and (exit_date is None or dt < exit_date), \
+                "Invalid date for an active position!"
 
-        stats = self._get_option_stats(curr_data)
+        stats = self._get_option_stats(curr_data, greeks=greeks)
         return stats
 
-    def plot_greek(self, greek, all_data):
-        curr_data = all_data.query("date == @self.entry_date")
-        underlying_px = curr_data['adjusted_close'].values[0]
-        strike = underlying_px * (
-            1 - self.relative_strike_pct if self.call_put == 'Call' else 1 + self.relative_strike_pct)
-        strike = base_round(strike, base=5)
-        expiration = curr_data.expiration.unique()[self.relative_expiration_months - 1]
-        option = curr_data.query("strike==@strike and expiration==@expiration and call_put==@self.call_put[0]")
-        option = option.to_dict('records')[0]
-
-        price = (option['bid'] + option['ask']) / 2
-        S = option['adjusted_close']
-        K = option['strike']
-        t = self._days_to_expiry(option['date'], expiration) / 365
-        r = 0.00
-
-        intrinsic = max(S - K, 0) if self.call_put == 'Call' else max(K - S, 0)
-        if price < intrinsic:
-            print(f"Below intrinsic: {self.active_position} {self.call_put} {S} {K} {t} {r} {price}")
-            print("Setting price to ask")
-            price = option['ask']
+    def plot_greek(self, greek, all_data: Optional[pd.DataFrame] = None):
+        """
+        :param all_data: Chain including the entry date. Only the entry date is read from the dataset when not given
+        """
+        if all_data is None:
+            all_data = self.dataset.view(self.entry_date, self.entry_date).to_frame()
+        curr_data = DayChain.from_frame(all_data.query("date == @self.entry_date"))
+        row = self._select_contract(curr_data)
+        S, K, t, r, price = self._pricing_inputs(curr_data, row, curr_data.expiry(row))
 
-        implied_vol = iv(price, S, K, t, r, 'c' if self.call_put == 'Call' else 'p')
+        vol = implied_vol(self._vol_flag, S, K, t, r, price)
         S_range = np.linspace(0.8 * S, 1.2 * S, 50)
         if greek=='price':
-            vals = [bs('c' if self.call_put == 'Call' else 'p', s, K, t, r, implied_vol) for s in S_range]
-        elif greek=='delta':
-            vals = [delta('c' if self.call_put == 'Call' else 'p', s, K, t, r, implied_vol) for s in S_range]
-        elif greek=='gamma':
-            vals = [gamma('c' if self.call_put == 'Call' else 'p', s, K, t, r, implied_vol) for s in S_range]
-        elif greek=='theta':
-            vals = [theta('c' if self.call_put == 'Call' else 'p', s, K, t, r, implied_vol) for s in S_range]
-        elif greek=='vega':
-            vals = [vega('c' if self.call_put == 'Call' else 'p', s, K, t, r, implied_vol) for s in S_range]
+            vals = bs_price(self._vol_flag, S_range, K, t, r, vol)
+        else:
+            vals = bs_greeks(self._vol_flag, S_range, K, t, r, vol)[greek]
         return S_range, vals, S, K
 
 
+    @property
+    def label(self) -> str:
+        if self.target_delta is not None:
+            return f"{self.call_put} {self.relative_expiration_months}mo {100 * self.target_delta:g} delta"
+        return f"{self.call_put} " \
+               f"{self.relative_expiration_months}mo " \
+               f"{100*abs(self.relative_strike_pct)}% {'ITM' if self.relative_strike_pct>0 else 'OTM'}"
+
     def __str__(self):
         if self.active_position is not None:
             return self.active_position
         else:
-            return f"{self.call_put} " \
-                   f"{self.relative_expiration_months}mo " \
-                   f"{100*abs(self.relative_strike_pct)}% {'ITM' if self.relative_strike_pct>0 else 'OTM'}"
\ No newline at end of file
+            return self.label
\ No newline at end of file
@@ -0,0 +1,124 @@
+from req_import import *
+from helpers import _date_pattern
+from Dataset import Dataset, resolve_dataset
+from Position import Position
+
+# Allowed values of the Literal parameters of Position
+_CHOICES = {'call_put': ('Call', 'Put'),
+            'buy_sell': ('Buy', 'Sell'),
+            'entry_side': ('Far', 'Mid', 'Near'),
+            'mtm_side': ('Far', 'Mid', 'Near'),
+            'strike_tie': ('up', 'down', 'otm', 'itm')}
+# Defaults of the optional columns, as in Position. Missing numbers are NaN, missing dates NaT
+_DEFAULTS = {'buy_sell': 'Buy', 'entry_side': 'Far', 'relative_strike_pct': np.nan, 'mtm_side': 'Mid',
+             'exit_date': None, 'target_delta': np.nan, 'strike_tie': 'up', 'shares': 1}
+COLUMNS = ('entry_date', 'call_put', 'buy_sell', 'entry_side', 'relative_strike_pct', 'relative_expiration_months',
+           'mtm_side', 'exit_date', 'target_delta', 'strike_tie', 'shares')
+
+
+def _dates(values, name: str, optional: bool, errors: List[str]) -> np.ndarray:
+    """
+    Parse 'YYYY-MM-DD' strings (or datetimes) to datetime64[ns], recording the rows that are not valid dates
+    """
+    values = pd.Series(values)
+    missing = values.isna() | (values.astype(str) == '') if optional else pd.Series(False, index=values.index)
+    if is_datetime64_any_dtype(values):
+        parsed = values
+        bad = values.isna() & ~missing
+    else:
+        well_formed = values.astype(str).str.match(_date_pattern)
+        parsed = pd.to_datetime(values.where(well_formed & ~missing), format='%Y-%m-%d', errors='coerce')
+        bad = ~missing & parsed.isna()
+    _check(bad.to_numpy(), f"{name} must be a date as YYYY-MM-DD", errors)
+    return parsed.to_numpy(dtype='datetime64[ns]')
+
+
+def _check(bad: np.ndarray, message: str, errors: List[str]):
+    if bad.any():
+        rows = np.flatnonzero(bad)
+        errors.append(f"{message}, rows {rows[:10].tolist()}{'...' if len(rows) > 10 else ''}")
+
+
+class PositionBook:
+    """
+    Many positions of one dataset as column arrays, validated as a batch with vectorized checks equivalent to those of
+    Position. Portfolio takes a book in place of a list of positions, which are then built without validating each
+    """
+    __slots__ = ('columns', 'dataset')
+
+    def __init__(self, entry_date, call_put, relative_expiration_months, dataset: Union[str, Dataset, None] = None,
+                 **columns):
+        """
+        :param entry_date, call_put, relative_expiration_months: Per-position arrays, or scalars for all
+        :param columns: Other Position parameters as arrays or scalars, plus ``shares``. Defaults as in Position
+        :raises ValueError: Listing every violated constraint and the offending rows
+        """
+        unknown = set(columns) - set(COLUMNS)
+        assert not unknown, f"Unknown columns {sorted(unknown)}"
+        columns = {**_DEFAULTS, **columns, 'entry_date': entry_date, 'call_put': call_put,
+                   'relative_expiration_months': relative_expiration_months}
+        n = max((len(v) for v in columns.values() if np.ndim(v) > 0), default=1)
+        columns = {k: np.asarray(v) if np.ndim(v) > 0 else np.full(n, v) for k, v in columns.items()}
+        assert all(len(v) == n for v in columns.values()), "Columns must have the same length"
+        for k in _CHOICES:
+            # Missing values of a frame column take the default
+            columns[k] = np.where(pd.isna(columns[k]), _DEFAULTS.get(k), columns[k])
+
+        errors = []
+        out = {'entry_date': _dates(columns['entry_date'], 'entry_date', False, errors),
+               'exit_date': _dates(columns['exit_date'], 'exit_date', True, errors)}
+        for k, choices in _CHOICES.items():
+            _check(~np.isin(columns[k], choices), f"{k} must be one of {choices}", errors)
+            out[k] = columns[k].astype(str)
+        for k in ('relative_strike_pct', 'target_delta', 'relative_expiration_months', 'shares'):
+            out[k] = pd.to_numeric(pd.Series(columns[k]), errors='coerce').to_numpy(dtype=float)
+            _check(pd.isna(out[k]) & pd.notna(pd.Series(columns[k])).to_numpy(), f"{k} must be a number", errors)
+
+        pct, delta = out['relative_strike_pct'], out['target_delta']
+        _check(pct < -1, "relative_strike_pct must be >= -1", errors)
+        _check(pct > 1, "relative_strike_pct must be <= 1", errors)
+        _check((delta <= 0) | (delta >= 1), "target_delta must be within (0, 1)", errors)
+        _check(np.isnan(pct) == np.isnan(delta), "Select the strike by either relative_strike_pct or target_delta",
+               errors)
+        for k in ('relative_expiration_months', 'shares'):
+            _check(~(out[k] >= 1) | (out[k] != np.floor(out[k])), f"{k} must be an integer >= 1", errors)
+        if errors:
+            raise ValueError("Invalid positions:\n" + "\n".join(errors))
+        for k in ('relative_expiration_months', 'shares'):
+            out[k] = out[k].astype(np.int64)
+        self.columns: Dict[str, np.ndarray] = out
+        self.dataset = resolve_dataset(dataset)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, dataset: Union[str, Dataset, None] = None) -> 'PositionBook':
+        """
+        One position per row, columns named after the Position parameters plus an optional ``shares``
+        """
+        return cls(dataset=dataset, **{k: df[k].to_numpy() for k in df.columns})
+
+    def __len__(self):
+        return len(self.columns['entry_date'])
+
+    @property
+    def shares(self) -> np.ndarray:
+        return self.columns['shares']
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({k: self.columns[k] for k in COLUMNS})
+
+    def positions(self) -> List[Position]:
+        """
+        Fresh Position objects of the book, one per row
+        """
+        c = self.columns
+        entry_dates = pd.DatetimeIndex(c['entry_date']).to_pydatetime()
+        exit_dates = [None if pd.isna(d) else d for d in pd.DatetimeIndex(c['exit_date']).to_pydatetime()]
+        pct = [None if np.isnan(x) else x for x in c['relative_strike_pct'].tolist()]
+        delta = [None if np.isnan(x) else x for x in c['target_delta'].tolist()]
+        return [Position._trusted(entry_date=entry_date, call_put=call_put, buy_sell=buy_sell, entry_side=entry_side,
+                                  relative_strike_pct=p, relative_expiration_months=months, mtm_side=mtm_side,
+                                  exit_date=exit_date, target_delta=d, strike_tie=tie, dataset=self.dataset)
+                for entry_date, call_put, buy_sell, entry_side, p, months, mtm_side, exit_date, d, tie
+                in zip(entry_dates, c['call_put'].tolist(), c['buy_sell'].tolist(), c['entry_side'].tolist(), pct,
+                       c['relative_expiration_months'].tolist(), c['mtm_side'].tolist(), exit_dates, delta,
+                       c['strike_tie'].tolist())]
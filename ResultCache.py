@@ -0,0 +1,115 @@
+from req_import import *
+
+# Bump whenever backtest output changes for the same inputs so cached results are not served
+CACHE_VERSION = 2
+
+
+class ResultCache:
+    """
+    Backtest results keyed by a canonical hash of the portfolio definition and the content of its dataset. An in-memory
+    LRU in front of an optional on-disk layer of pickles, evicted least recently used first once over its size budget
+    """
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 64, max_bytes: int = 1 << 29):
+        """
+        :param directory: On-disk layer. Memory only when not given
+        :param max_entries: Results kept in memory
+        :param max_bytes: Size budget of the on-disk layer
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory: 'OrderedDict[str, pd.DataFrame]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def dataset_definition(dataset) -> dict:
+        """
+        Identity of a dataset's content: its raw file's hash plus its trade dates and row count, which also covers
+        ingested days
+        """
+        store = dataset.store
+        source = store.source or {}
+        return {'sha1': source.get('sha1'), 'preprocess': source.get('version'),
+                'dates': [int(store.dates[0]), int(store.dates[-1]), len(store)] if len(store) else [],
+                'rows': int(store.offsets[-1])}
+
+    @staticmethod
+    def definition(portfolio) -> dict:
+        """
+        Every Position parameter, the shares, the date window and the dataset content of a portfolio
+        """
+        return {'version': CACHE_VERSION,
+                'start_date': portfolio.start_date.isoformat(),
+                'end_date': portfolio.end_date.isoformat(),
+                'shares': [float(s) for s in portfolio.shares_list],
+                'positions': [{**p.params(), 'exit_date': p.exit_date.isoformat()} for p in portfolio.position_list],
+                'dataset': ResultCache.dataset_definition(portfolio.dataset)}
+
+    @staticmethod
+    def key(portfolio) -> str:
+        """
+        Hash of the portfolio's ``definition``
+        """
+        return hashlib.sha1(json.dumps(ResultCache.definition(portfolio), sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key) -> Optional[pd.DataFrame]:
+        """
+        Copy of the cached result, None on a miss
+        """
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+            elif self.directory is not None and os.path.exists(self._path(key)):
+                with open(self._path(key), 'rb') as f:
+                    result = pkl.load(f)
+                os.utime(self._path(key))  # Recency for eviction
+                self._remember(key, result)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return result.copy()
+
+    def put(self, key, result: pd.DataFrame):
+        with self._lock:
+            result = result.copy()
+            result.attrs = {}
+            self._remember(key, result)
+            if self.directory is not None:
+                tmp_fp = self._path(key) + '.tmp'
+                with open(tmp_fp, 'wb') as f:
+                    pkl.dump(result, f, protocol=pkl.HIGHEST_PROTOCOL)
+                os.replace(tmp_fp, self._path(key))
+                self._evict()
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith('.pkl')]
+        entries.sort(key=lambda e: e.stat().st_mtime_ns)
+        total = sum(e.stat().st_size for e in entries)
+        for e in entries:
+            if total <= self.max_bytes:
+                break
+            total -= e.stat().st_size
+            os.remove(e.path)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.directory is not None:
+                for e in os.scandir(self.directory):
+                    if e.name.endswith('.pkl'):
+                        os.remove(e.path)
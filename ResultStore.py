@@ -0,0 +1,151 @@
+from req_import import *
+from ResultCache import ResultCache
+
+_CATALOG = 'catalog.sqlite'
+_NAME_PATTERN = r'[\w.-]+'
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    strategy TEXT NOT NULL,
+    created TEXT NOT NULL,
+    engine TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    n_days INTEGER,
+    final_pnl REAL,
+    min_pnl REAL,
+    max_pnl REAL,
+    columns TEXT NOT NULL,
+    config TEXT,
+    dataset TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_strategy ON runs (strategy);
+"""
+
+
+class ResultStore:
+    """
+    Backtest results on disk: one compressed file per run, under the directory of its strategy, holding each column as
+    its own array, plus a SQLite catalog of the runs (strategy, portfolio config, dataset fingerprint, timings and
+    summary stats). Runs are selected with SQL predicates on the catalog and only the columns asked for are read
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(os.path.join(self.directory, _CATALOG))
+        try:
+            with conn:  # Commits, or rolls back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def _path(self, strategy: str, run_id: str) -> str:
+        return os.path.join(self.directory, strategy, f"{run_id}.npz")
+
+    def put(self, result: pd.DataFrame, strategy: str = 'default', portfolio=None, config: Optional[dict] = None,
+            dataset=None, engine: Optional[str] = None, run_id: Optional[str] = None) -> str:
+        """
+        Store the daily stats of a run and catalog it
+        :param portfolio: Portfolio of the run, recorded as its config and dataset fingerprint
+        :param config: Config to record instead, e.g. a sweep configuration
+        :param dataset: Dataset to fingerprint when no portfolio is given
+        :param run_id: Replaces the run of that id. A new id when not given
+        :return: The run id
+        """
+        assert re.fullmatch(_NAME_PATTERN, strategy), "Strategy names are letters, digits, '_', '.' and '-'"
+        run_id = uuid.uuid4().hex if run_id is None else run_id
+        assert re.fullmatch(_NAME_PATTERN, run_id), "Run ids are letters, digits, '_', '.' and '-'"
+        definition = ResultCache.definition(portfolio) if portfolio is not None else {}
+        if config is None:
+            config = {k: v for k, v in definition.items() if k != 'dataset'} or None
+        if dataset is not None and 'dataset' not in definition:
+            definition['dataset'] = ResultCache.dataset_definition(dataset)
+        timings = result.attrs.get('timings')
+        if timings is not None:
+            timings = timings.groupby('stage')['seconds'].sum().to_dict()
+
+        # Text columns are stored as fixed-width strings so runs load without unpickling
+        arrays = {col: result[col].to_numpy().astype(str) if result[col].dtype == object else result[col].to_numpy()
+                  for col in result.columns}
+        fp = self._path(strategy, run_id)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        tmp_fp = f"{fp}.tmp.npz"
+        np.savez_compressed(tmp_fp, **arrays)
+        os.replace(tmp_fp, fp)
+
+        pnl = result['PnL'].to_numpy(dtype=float) if 'PnL' in result and len(result) else None
+        dates = result['date'] if 'date' in result and len(result) else None
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (run_id, strategy, datetime.now().isoformat(timespec='seconds'), engine,
+                          None if dates is None else dates.min().strftime('%Y-%m-%d'),
+                          None if dates is None else dates.max().strftime('%Y-%m-%d'),
+                          len(result),
+                          None if pnl is None else float(pnl[-1]),
+                          None if pnl is None else float(pnl.min()),
+                          None if pnl is None else float(pnl.max()),
+                          json.dumps(list(result.columns)),
+                          None if config is None else json.dumps(config, default=str),
+                          None if 'dataset' not in definition else json.dumps(definition['dataset']),
+                          None if timings is None else json.dumps(timings)))
+        return run_id
+
+    def runs(self, where: Optional[str] = None, params=(), strategy: Optional[str] = None) -> pd.DataFrame:
+        """
+        Catalog entries, most recent first
+        :param where: SQL predicate on the runs table, e.g. "final_pnl > ? AND json_extract(config,
+                        '$.positions[0].call_put') = 'Put'"
+        :param params: Values of the predicate's placeholders
+        :param strategy: Only runs of this strategy
+        """
+        clauses, values = [], []
+        if strategy is not None:
+            clauses.append("strategy = ?")
+            values.append(strategy)
+        if where is not None:
+            clauses.append(f"({where})")
+            values.extend(params)
+        sql = "SELECT * FROM runs" + (" WHERE " + " AND ".join(clauses) if clauses else "") + " ORDER BY created DESC"
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=values)
+
+    def load(self, run_id: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Daily stats of a run. Only the given columns, plus the date, are decompressed
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT strategy FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No run {run_id}")
+        return self._read(row[0], run_id, columns)
+
+    def _read(self, strategy: str, run_id: str, columns: Optional[List[str]]) -> pd.DataFrame:
+        with np.load(self._path(strategy, run_id), allow_pickle=False) as z:
+            if columns is not None:
+                columns = (['date'] if 'date' in z.files and 'date' not in columns else []) + list(columns)
+            return pd.DataFrame({col: z[col] for col in (z.files if columns is None else columns)})
+
+    def load_runs(self, where: Optional[str] = None, params=(), strategy: Optional[str] = None,
+                  columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Daily stats of every run matching ``runs(where, params, strategy)``, stacked with a run_id column
+        """
+        runs = self.runs(where, params, strategy)
+        frames = [self._read(s, run_id, columns) for s, run_id in zip(runs['strategy'], runs['run_id'])]
+        for run_id, df in zip(runs['run_id'], frames):
+            df.insert(0, 'run_id', run_id)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['run_id'])
+
+    def delete(self, run_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT strategy FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+        os.remove(self._path(row[0], run_id))
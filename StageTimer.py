@@ -0,0 +1,138 @@
+from req_import import *
+
+
+class StageTimer:
+    """
+    Times the stages of a backtest. The base timer is disabled: ``stage`` hands back one shared no-op context manager,
+    so instrumented code costs a method call per stage and records nothing
+    """
+    enabled = False
+    _NULL = contextlib.nullcontext()
+
+    def day_start(self, date):
+        pass
+
+    def stage(self, name: str, position=None):
+        return self._NULL
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class _Stage:
+    __slots__ = ('_totals', '_key', '_start')
+
+    def __init__(self, totals, key):
+        self._totals = totals
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        total = self._totals.get(self._key)
+        self._totals[self._key] = (elapsed, 1) if total is None else (total[0] + elapsed, total[1] + 1)
+
+
+class StageProfiler(StageTimer):
+    """
+    Cumulative wall time and call count per (stage, leg, day). Legs are told apart by position object, not label, and
+    numbered in the order first seen, which is their index in the position_list of a single portfolio. Stages nest, so
+    a stage's time includes that of the stages run inside it. Optionally also runs cProfile and/or tracemalloc between
+    ``start`` and ``stop``
+    """
+    enabled = True
+
+    def __init__(self, cprofile: bool = False, trace_memory: bool = False):
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self._totals: Dict[tuple, Tuple[float, int]] = {}
+        # id(position) -> leg number. The positions are kept so that their ids are not reused
+        self._legs: Dict[int, int] = {}
+        self._positions: list = []
+        self._date = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._peak_memory: Optional[int] = None
+
+    def day_start(self, date):
+        self._date = date
+
+    def stage(self, name, position=None):
+        return _Stage(self._totals, (name, None if position is None else self._leg(position), self._date))
+
+    def _leg(self, position) -> int:
+        leg = self._legs.get(id(position))
+        if leg is None:
+            leg = self._legs[id(position)] = len(self._positions)
+            self._positions.append(position)
+        return leg
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+        if self.trace_memory:
+            self._snapshot = tracemalloc.take_snapshot()
+            self._peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self._date = None
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        One row per (stage, leg, date) with the cumulative seconds and calls, and the leg's position label. leg,
+        position and date are None for stages that are not specific to one
+        """
+        return pd.DataFrame([(name, leg, None if leg is None else self._positions[leg].label, date, seconds, calls)
+                             for (name, leg, date), (seconds, calls) in self._totals.items()],
+                            columns=['stage', 'leg', 'position', 'date', 'seconds', 'calls']).astype({'leg': 'Int64'})
+
+    def summary(self, by: Literal['stage', 'position', 'date'] = 'stage') -> pd.DataFrame:
+        """
+        Seconds and calls per stage, optionally broken down by leg (with its position label) or date as well
+        """
+        keys = {'stage': ['stage'], 'position': ['stage', 'leg', 'position'], 'date': ['stage', 'date']}[by]
+        return (self.to_frame().groupby(keys, dropna=False)[['seconds', 'calls']].sum()
+                .sort_values('seconds', ascending=False))
+
+    def report(self, top: int = 25) -> str:
+        """
+        Stage summary followed by the cProfile and tracemalloc top entries, when those ran
+        """
+        out = io.StringIO()
+        out.write(self.summary().to_string())
+        if self._profile is not None:
+            out.write("\n\ncProfile, by cumulative time:\n")
+            pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(top)
+        if self._snapshot is not None:
+            out.write(f"\ntracemalloc, peak {self._peak_memory / 2 ** 20:.1f} MiB, top allocations:\n")
+            for stat in self._snapshot.statistics('lineno')[:top]:
+                out.write(f"{stat}\n")
+        return out.getvalue()
+
+    def dump(self, directory):
+        """
+        Write timings.csv, report.txt and, when cProfile ran, profile.prof (for pstats/snakeviz) into ``directory``
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.to_frame().to_csv(os.path.join(directory, "timings.csv"), index=False)
+        with open(os.path.join(directory, "report.txt"), 'w') as f:
+            f.write(self.report())
+        if self._profile is not None:
+            self._profile.dump_stats(os.path.join(directory, "profile.prof"))
+
+    def clear(self):
+        self._totals.clear()
+        self._legs.clear()
+        self._positions.clear()
+        self._profile = self._snapshot = self._peak_memory = None
@@ -0,0 +1,52 @@
+from req_import import *
+
+# Daily PnL explained by the Greeks: each leg's PnL change from one trade date to the next is split into the Taylor
+# terms of the previous close's delta, gamma, theta and vega against the moves in spot, time and implied vol, computed
+# for all legs and days at once from leg paths in the layout of compiled.leg_paths, as every engine of
+# Portfolio.run_backtest produces them. What the Greeks do not explain, including the entry spread, the mark side
+# against the pricing mid and expiry, is the residual
+COMPONENTS = ('delta_PnL', 'gamma_PnL', 'theta_PnL', 'vega_PnL', 'residual_PnL')
+
+
+def leg_attribution(paths: dict) -> Dict[str, np.ndarray]:
+    """
+    (legs, days) matrices per share, with the side applied, of each leg's daily PnL ('daily_PnL') and its COMPONENTS
+    """
+    legs = paths['legs']
+    sign = legs['sign'][:, None]
+    pnl = paths['PnL']
+    daily = np.diff(pnl, axis=1, prepend=0.)
+
+    spot = np.asarray(paths['SPX'], dtype=float)
+    d_spot = np.diff(spot, prepend=spot[:1])[None, :]
+    days = np.diff(np.asarray(paths['dates'], dtype='datetime64[D]').astype(np.int64), prepend=0)[None, :]
+    # Greeks of the previous close, for legs that were held over it
+    active = paths['active']
+    held = np.roll(active, 1, axis=1)
+    held[:, :1] = False
+    # The vol move is only known while the leg is still marked at the close
+    marked = held & active
+
+    def previous(stat):
+        values = np.roll(paths[stat], 1, axis=1)
+        return np.where(held & np.isfinite(values), values, 0.)
+
+    iv_change = np.where(marked, paths['iv'] - np.roll(paths['iv'], 1, axis=1), 0.)
+    out = {'daily_PnL': daily,
+           'delta_PnL': sign * previous('delta') * d_spot,
+           'gamma_PnL': sign * 0.5 * previous('gamma') * d_spot ** 2,
+           'theta_PnL': sign * previous('theta') * days,
+           # vega is per vol point, implied vols are fractions
+           'vega_PnL': sign * previous('vega') * np.nan_to_num(iv_change) * 100}
+    out['residual_PnL'] = daily - sum(out[c] for c in COMPONENTS[:-1])
+    return out
+
+
+def attribute(paths: dict) -> pd.DataFrame:
+    """
+    Portfolio level daily PnL and its COMPONENTS, summed over the legs with their shares
+    """
+    shares = paths['legs']['shares'][:, None]
+    attributed = leg_attribution(paths)
+    return pd.DataFrame({'date': paths['dates'],
+                         **{col: (shares * values).sum(axis=0) for col, values in attributed.items()}})
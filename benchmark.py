@@ -0,0 +1,175 @@
+from req_import import *
+from Dataset import Dataset
+from Portfolio import Portfolio, Position
+from Options import OptionFromPrice, EuropeanCall
+from black_scholes import implied_vol, iv_and_greeks
+from synthetic import write_synthetic_csv
+
+# Benchmarks of the pipeline stages over synthetic chains of growing size. Results are written as JSON records
+# (benchmark, size, seconds, throughput) so runs can be diffed against each other with --compare
+SIZES = {'small': dict(n_days=21, n_expirations=4, n_strikes=80),
+         'medium': dict(n_days=42, n_expirations=8, n_strikes=160),
+         'large': dict(n_days=63, n_expirations=11, n_strikes=320)}
+# Scalar solvers are timed on a sample of the quotes only
+_SCALAR_SAMPLE = 2000
+
+
+def timeit(fn, repeat: int = 3, setup=None) -> Tuple[float, float]:
+    """
+    Best and mean wall time of ``fn()`` over ``repeat`` runs. ``setup()`` runs untimed before each
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+
+def _portfolio(dataset: Dataset) -> Portfolio:
+    start, end = (str(d)[:10] for d in dataset.dates[[0, -1]])
+    positions = [Position(entry_date=start, call_put='Call', buy_sell='Sell', relative_strike_pct=-0.01,
+                          relative_expiration_months=2, dataset=dataset),
+                 Position(entry_date=start, call_put='Put', buy_sell='Buy', relative_strike_pct=-0.02,
+                          relative_expiration_months=1, dataset=dataset)]
+    return Portfolio(start_date=start, end_date=end, positions=positions, shares=[1, 2])
+
+
+def _quotes(dataset: Dataset) -> dict:
+    df = dataset.frame
+    df = df[df['expiration'] > df['date']]
+    return {'flag': df['call_put'].str.lower().values, 'S': df['adjusted_close'].values,
+            'K': df['strike'].values.astype(float), 't': ((df['expiration'] - df['date']).dt.days / 365).values,
+            'price': ((df['bid'] + df['ask']) / 2).values}
+
+
+def bench_size(name: str, directory: str, repeat: int = 3) -> List[dict]:
+    """
+    Time every stage on a synthetic chain of the given size
+    """
+    params = SIZES[name]
+    csv_fp, store_fp = os.path.join(directory, f"{name}.csv"), os.path.join(directory, f"{name}_store")
+    rows = write_synthetic_csv(csv_fp, **params)
+    results = []
+
+    def record(benchmark, best_mean, items):
+        best, mean = best_mean
+        results.append({'benchmark': benchmark, 'size': name, **params, 'rows': rows, 'items': items,
+                        'seconds': best, 'mean_seconds': mean, 'items_per_second': items / best if best else None})
+
+    def clear_store():
+        shutil.rmtree(store_fp, ignore_errors=True)
+
+    record('load_preprocess', timeit(lambda: Dataset(csv_fp, store_fp).store, repeat, setup=clear_store), rows)
+    record('open_store', timeit(lambda: Dataset(csv_fp, store_fp).store, repeat), rows)
+
+    dataset = Dataset(csv_fp, store_fp)
+    n_days = len(dataset.dates)
+    record('to_frame', timeit(lambda: dataset.store.to_frame(), repeat), rows)
+    record('day_frame', timeit(lambda: [dataset.day(i) for i in range(n_days)], repeat), n_days)
+    record('day_chain', timeit(lambda: [dataset.chain(i) for i in range(n_days)], repeat), n_days)
+
+    chains = [dataset.chain(i) for i in range(n_days)]
+    portfolio = _portfolio(dataset)
+    position = portfolio.position_list[0]
+    record('process_date', timeit(lambda: [position.process_date(pd.Timestamp(d), c)
+                                           for d, c in zip(dataset.dates, chains)], repeat, setup=position.reset),
+           n_days)
+    position.reset()
+
+    def backtest(engine):
+        return lambda: portfolio.run_backtest(engine=engine, use_cache=False)
+
+    for engine in ('loop', 'compiled'):
+        record(f'run_backtest_{engine}', timeit(backtest(engine), repeat), n_days)
+    record('build_surface', timeit(lambda: dataset.build_surface(processes=1), 1), rows)
+    for engine in ('loop', 'compiled'):
+        record(f'run_backtest_{engine}_surface', timeit(backtest(engine), repeat), n_days)
+
+    q = _quotes(dataset)
+    n = len(q['price'])
+    record('implied_vol', timeit(lambda: implied_vol(q['flag'], q['S'], q['K'], q['t'], 0., q['price']), repeat), n)
+    record('iv_and_greeks', timeit(lambda: iv_and_greeks(q['flag'], q['S'], q['K'], q['t'], 0., q['price']), repeat),
+           n)
+    sigma = np.nan_to_num(implied_vol(q['flag'], q['S'], q['K'], q['t'], 0., q['price']), nan=0.2)
+    record('options_batch_greeks', timeit(lambda: EuropeanCall.batch(q['S'], sigma, q['K'], q['t']), repeat), n)
+
+    sample = np.random.default_rng(0).choice(n, min(n, _SCALAR_SAMPLE), replace=False)
+    sample = [(q['flag'][i], float(q['S'][i]), float(q['K'][i]), float(q['t'][i]), float(q['price'][i]))
+              for i in sample]
+
+    def options_scalar():
+        for f, S, K, t, px in sample:
+            try:
+                OptionFromPrice(f.upper(), S, px, K, t, 0.)
+            except ValueError:
+                pass
+
+    def py_vollib_scalar():
+        for f, S, K, t, px in sample:
+            try:
+                sigma = iv(px, S, K, t, 0., f)
+                delta(f, S, K, t, 0., sigma), gamma(f, S, K, t, 0., sigma)
+                theta(f, S, K, t, 0., sigma), vega(f, S, K, t, 0., sigma)
+            except BelowIntrinsicException:
+                pass
+
+    record('options_scalar', timeit(options_scalar, repeat), len(sample))
+    with np.errstate(all='ignore'):
+        record('py_vollib_scalar', timeit(py_vollib_scalar, repeat), len(sample))
+    return results
+
+
+def _meta() -> dict:
+    commit = os.popen('git rev-parse --short HEAD 2>/dev/null').read().strip() or None
+    return {'timestamp': datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def run_benchmarks(sizes=tuple(SIZES), repeat: int = 3, directory: Optional[str] = None) -> dict:
+    """
+    :param directory: Where the synthetic files go. A temporary directory, removed afterwards, by default
+    :return: {'meta': run information, 'results': one record per (benchmark, size)}
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in sizes:
+            results.extend(bench_size(name, directory or tmp, repeat))
+    return {'meta': _meta(), 'results': results}
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    Per (benchmark, size) time ratio of ``current`` over ``baseline``, flagging slowdowns beyond ``tolerance``
+    """
+    keys = ['benchmark', 'size']
+    df = pd.DataFrame(current['results'])[keys + ['seconds']].merge(
+        pd.DataFrame(baseline['results'])[keys + ['seconds']], on=keys, suffixes=('', '_baseline'))
+    df['ratio'] = df['seconds'] / df['seconds_baseline']
+    df['regression'] = df['ratio'] > 1 + tolerance
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the backtest pipeline on synthetic chains")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="Earlier results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(pd.DataFrame(report['results'])[['benchmark', 'size', 'rows', 'seconds', 'items_per_second']]
+          .to_string(index=False))
+    if args.compare:
+        with open(args.compare) as f:
+            diff = compare(report, json.load(f), args.tolerance)
+        print(diff.to_string(index=False))
+        if diff['regression'].any():
+            raise SystemExit(1)
@@ -0,0 +1,159 @@
+from req_import import *
+
+# Vectorized Black-Scholes pricing, implied vol and Greeks. Every function takes array-likes (scalars broadcast) and
+# follows py_vollib's conventions: flag is 'c' or 'p', theta is per calendar day and vega per vol point
+_MIN_VOL = 1e-6
+_MAX_VOL = 10.
+_VOL_TOL = 1e-10
+_MAX_ITER = 100
+# Standardized moneyness |log(X / S)| / (sigma sqrt(t)) beyond which the wing asymptotic seeds the solver
+_WING_MONEYNESS = 1.5
+GREEKS = ('delta', 'gamma', 'theta', 'vega')
+# Per-option status of implied_vol
+IV_CONVERGED = 0
+IV_MAX_ITER = 1
+IV_OUT_OF_BOUNDS = 2
+IV_EXPIRED = 3
+
+
+def _is_call(flag) -> np.ndarray:
+    flag = np.asarray(flag)
+    if flag.dtype == bool:
+        return flag
+    return np.char.lower(flag.astype(str)) == 'c'
+
+
+def _d1_d2(S, K, t, r, sigma):
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(S / K) + (r + sigma ** 2 / 2) * t) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def bs_price(flag, S, K, t, r, sigma) -> np.ndarray:
+    is_call, S, K, t, r, sigma = np.broadcast_arrays(_is_call(flag), *map(np.asarray, (S, K, t, r, sigma)))
+    d1, d2 = _d1_d2(S, K, t, r, sigma)
+    disc_K = K * np.exp(-r * t)
+    return np.where(is_call, S * ndtr(d1) - disc_K * ndtr(d2), disc_K * ndtr(-d2) - S * ndtr(-d1))
+
+
+def bs_greeks(flag, S, K, t, r, sigma) -> Dict[str, np.ndarray]:
+    """
+    Analytical delta, gamma, theta and vega in one pass
+    """
+    is_call, S, K, t, r, sigma = np.broadcast_arrays(_is_call(flag), *map(np.asarray, (S, K, t, r, sigma)))
+    d1, d2 = _d1_d2(S, K, t, r, sigma)
+    sqrt_t = np.sqrt(t)
+    pdf_d1 = np.exp(-d1 ** 2 / 2) / np.sqrt(2 * np.pi)
+    cdf_d1 = ndtr(d1)
+    rate_term = r * K * np.exp(-r * t)
+    decay = -S * pdf_d1 * sigma / (2 * sqrt_t)
+    return {'delta': np.where(is_call, cdf_d1, cdf_d1 - 1.),
+            'gamma': pdf_d1 / (S * sigma * sqrt_t),
+            'theta': np.where(is_call, decay - rate_term * ndtr(d2), decay + rate_term * ndtr(-d2)) / 365.,
+            'vega': S * pdf_d1 * sqrt_t * 0.01}
+
+
+def bs_price_and_greeks(flag, S, K, t, r, sigma) -> Dict[str, np.ndarray]:
+    """
+    Price, first order (delta, vega, theta, rho) and second order (gamma, vanna, volga) Greeks from their closed
+    forms. vega and rho are per point, theta per day as in bs_greeks. vanna (d delta / d sigma) and volga
+    (d^2 price / d sigma^2) are raw partial derivatives
+    """
+    is_call, S, K, t, r, sigma = np.broadcast_arrays(_is_call(flag), *map(np.asarray, (S, K, t, r, sigma)))
+    d1, d2 = _d1_d2(S, K, t, r, sigma)
+    sqrt_t = np.sqrt(t)
+    pdf_d1 = np.exp(-d1 ** 2 / 2) / np.sqrt(2 * np.pi)
+    disc_K = K * np.exp(-r * t)
+    vega = S * pdf_d1 * sqrt_t
+    decay = -S * pdf_d1 * sigma / (2 * sqrt_t)
+    return {'price': np.where(is_call, S * ndtr(d1) - disc_K * ndtr(d2), disc_K * ndtr(-d2) - S * ndtr(-d1)),
+            'delta': np.where(is_call, ndtr(d1), ndtr(d1) - 1.),
+            'vega': vega * 0.01,
+            'theta': np.where(is_call, decay - r * disc_K * ndtr(d2), decay + r * disc_K * ndtr(-d2)) / 365.,
+            'rho': np.where(is_call, t * disc_K * ndtr(d2), -t * disc_K * ndtr(-d2)) * 0.01,
+            'gamma': pdf_d1 / (S * sigma * sqrt_t),
+            'vanna': -pdf_d1 * d2 / sigma,
+            'volga': vega * d1 * d2 / sigma}
+
+
+def _initial_vol(S, X, t, otm_call, otm_price):
+    """
+    Closed-form starting point for the solver. Around the money: Corrado-Miller on the call price implied by parity.
+    In the wings: the Mills-ratio asymptotic of the normalized out-of-the-money price b = price / sqrt(S X),
+        log(b) ~ -x^2 / (2 s^2) - s^2 / 8 + log(s^3 / (x^2 sqrt(2 pi))),  x = log(X / S), s = sigma sqrt(t)
+    inverted by a few fixed-point steps
+    """
+    call = np.where(otm_call, otm_price, otm_price + S - X)
+    a = call - (S - X) / 2
+    corrado_miller = np.sqrt(2 * np.pi / t) / (S + X) * (a + np.sqrt(np.maximum(a ** 2 - (S - X) ** 2 / np.pi, 0)))
+
+    x2 = np.log(X / S) ** 2
+    log_b = np.log(otm_price / np.sqrt(S * X))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.sqrt(x2 / (-2 * log_b))
+        for _ in range(3):
+            s = np.sqrt(x2 / np.maximum(-2 * (log_b + s ** 2 / 8 - np.log(s ** 3 / (x2 * np.sqrt(2 * np.pi)))), 1e-12))
+    wing = s / np.sqrt(t)
+    use_wing = np.isfinite(wing) & (x2 > (_WING_MONEYNESS * s) ** 2)
+    return np.clip(np.where(use_wing, wing, corrado_miller), _MIN_VOL * 10, _MAX_VOL / 2)
+
+
+def implied_vol(flag, S, K, t, r, price, return_status=False):
+    """
+    Implied vol of every option at once.
+
+    Each option is solved on its out-of-the-money equivalent (by put-call parity) with Newton steps on log(price),
+    which is concave in vol so the iteration cannot overshoot, starting from a closed-form guess. Steps leaving the
+    bracket of vols known to be too low/high fall back to bisection. Converges in a handful of iterations across
+    moneyness and expiries, to ``_VOL_TOL`` in vol.
+    :param return_status: Also return the per-option status: IV_CONVERGED, IV_MAX_ITER, IV_OUT_OF_BOUNDS (price
+                            outside the no-arbitrage bounds, e.g. below intrinsic) or IV_EXPIRED
+    :return: Vols, NaN where the solver did not converge
+    """
+    is_call, S, K, t, r, price = np.broadcast_arrays(_is_call(flag), *map(np.asarray, (S, K, t, r, price)))
+    shape = price.shape
+    is_call = is_call.ravel()
+    S, K, t, r, price = (a.ravel().astype(float) for a in (S, K, t, r, price))
+    X = K * np.exp(-r * t)
+    otm_call = X >= S
+    # Parity moves ITM options onto the OTM side, where the price carries the vol information
+    otm_price = price + np.where(is_call, np.where(otm_call, 0., X - S), np.where(otm_call, S - X, 0.))
+    upper = np.where(otm_call, S, X)
+
+    sigma = np.full(len(price), np.nan)
+    status = np.full(len(price), IV_OUT_OF_BOUNDS, dtype=np.int8)
+    status[t <= 0] = IV_EXPIRED
+    idx = np.flatnonzero((t > 0) & (otm_price > 0) & (otm_price < upper))
+    status[idx] = IV_MAX_ITER
+
+    lo, hi = np.full(len(idx), _MIN_VOL), np.full(len(idx), _MAX_VOL)
+    guess = _initial_vol(S[idx], X[idx], t[idx], otm_call[idx], otm_price[idx])
+    for _ in range(_MAX_ITER):
+        if len(idx) == 0:
+            break
+        c, s_, k, t_, r_, target = otm_call[idx], S[idx], K[idx], t[idx], r[idx], otm_price[idx]
+        model = bs_price(c, s_, k, t_, r_, guess)
+        d1, _d2 = _d1_d2(s_, k, t_, r_, guess)
+        vega = s_ * np.exp(-d1 ** 2 / 2) / np.sqrt(2 * np.pi) * np.sqrt(t_)
+        # Price is increasing in vol, so the sign of the error tells which side of the root we are on
+        hi = np.where(model > target, guess, hi)
+        lo = np.where(model <= target, guess, lo)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = guess - np.log(model / target) * model / vega
+        step = np.where(np.isfinite(step) & (step >= lo) & (step <= hi), step, (lo + hi) / 2)
+        done = np.abs(step - guess) < _VOL_TOL
+        sigma[idx[done]] = step[done]
+        status[idx[done]] = IV_CONVERGED
+        idx, lo, hi, guess = idx[~done], lo[~done], hi[~done], step[~done]
+    sigma = sigma.reshape(shape)
+    return (sigma, status.reshape(shape)) if return_status else sigma
+
+
+def iv_and_greeks(flag, S, K, t, r, price) -> Dict[str, np.ndarray]:
+    """
+    Implied vol from the option price plus all Greeks at that vol, for arrays of options
+    """
+    sigma = implied_vol(flag, S, K, t, r, price)
+    out = {'iv': sigma}
+    out.update(bs_greeks(flag, S, K, t, r, sigma))
+    return out
@@ -0,0 +1,153 @@
+from req_import import *
+from ChainStore import ChainView, SURFACE_COLUMNS
+from black_scholes import iv_and_greeks
+
+# Array-compiled backtest: every Position is resolved up front (contract, entry price, entry and close day) and the
+# daily marks, IV and Greeks of all legs over all days come out of vectorized gathers on the window's columns.
+# Same semantics and output schema as the per-day loop in Portfolio.run_backtest
+STATS = ('value', 'PnL', 'iv', 'delta', 'gamma', 'theta', 'vega')
+_COLUMNS = ['adjusted_close', 'strike', 'expiration', 'bid', 'ask', 'pricing_mid', 'option_symbol']
+_RATE = 0.00
+
+
+def _touch(side, buying, bid, ask):
+    """
+    Position._touch_price over arrays. ``side`` and ``buying`` are per-leg arrays broadcast against the quotes
+    """
+    return np.where(side == 'Mid', (bid + ask) / 2,
+                    np.where((side == 'Far') == buying, ask, bid))
+
+
+def resolve_legs(portfolio, view: Optional[ChainView] = None) -> dict:
+    """
+    Resolve every position of the portfolio into per-leg arrays over its backtest window
+    :param view: The portfolio's data_view, if already made
+    """
+    view = portfolio.data_view() if view is None else view
+    lo, hi = view.lo, view.hi
+    dates = portfolio.dataset.dates[lo:hi]
+    positions = portfolio.position_list
+    n_legs, n_days = len(positions), hi - lo
+
+    legs = {'entry_day': np.full(n_legs, n_days), 'close_day': np.full(n_legs, n_days),
+            'expires': np.zeros(n_legs, dtype=bool), 'code': np.full(n_legs, -1, dtype=np.int64),
+            'entry_price': np.zeros(n_legs), 'expiry': np.zeros(n_legs, dtype=np.int64),
+            'is_call': np.array([p.call_put == 'Call' for p in positions]),
+            'sign': np.array([1. if p.buy_sell == 'Buy' else -1. for p in positions]),
+            'shares': np.asarray(portfolio.shares_list, dtype=float),
+            'entry_side': np.array([p.entry_side for p in positions]),
+            'mtm_side': np.array([p.mtm_side for p in positions])}
+    chains = {}
+    for j, p in enumerate(positions):
+        e = int(np.searchsorted(dates, np.datetime64(p.entry_date)))
+        if e == n_days:  # Entry is after the window
+            continue
+        assert dates[e] == np.datetime64(p.entry_date), "Have not processed entry date yet!"
+        if e not in chains:
+            chains[e] = view.chain(lo + e)
+        chain = chains[e]
+        row = p._select_contract(chain)
+        expiry = chain.expiry(row)
+        legs['entry_day'][j] = e
+        legs['code'][j] = chain.arrays['option_symbol'][row]
+        legs['expiry'][j] = chain.arrays['expiration'][row]
+        legs['entry_price'][j] = p._touch_price(p.entry_side, chain['bid'][row], chain['ask'][row], opening=True)
+
+        # The position is checked for expiry/exit from the day after entry on
+        c = max(int(np.searchsorted(dates, np.datetime64(min(expiry, pd.Timestamp(p.exit_date))))), e + 1)
+        if c < n_days:
+            close_date = dates[c]
+            assert close_date in (np.datetime64(expiry), np.datetime64(p.exit_date)), \
+                "Invalid date for an active position!"
+            legs['expires'][j] = close_date == np.datetime64(expiry)
+        legs['close_day'][j] = c
+    return {'lo': lo, 'hi': hi, 'dates': dates, 'legs': legs, 'view': view}
+
+
+def leg_paths(portfolio, resolved: Optional[dict] = None) -> dict:
+    """
+    Per-leg, per-share daily stats of the portfolio as (legs, days) matrices, as Position.process_date reports them,
+    and whether each leg is held at each day's close ('active')
+    """
+    resolved = resolve_legs(portfolio) if resolved is None else resolved
+    view = resolved['view']
+    store = view.store
+    lo, hi, legs = resolved['lo'], resolved['hi'], resolved['legs']
+    n_legs, n_days = len(legs['code']), hi - lo
+
+    use_surface = set(store.missing(SURFACE_COLUMNS.values())).isdisjoint(range(lo, hi))
+    columns = _COLUMNS + (list(SURFACE_COLUMNS.values()) if use_surface else [])
+    cols = view.concat(columns)
+    rows_per_day = view.rows
+    day_ordinals = store.dates[lo:hi].astype(np.int64)
+
+    # (day, symbol code) -> row over the whole window with one sort and one binary search
+    n_codes = int(cols['option_symbol'].max(initial=0)) + 1
+    key = np.repeat(np.arange(n_days, dtype=np.int64), rows_per_day) * n_codes + cols['option_symbol']
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+
+    day = np.arange(n_days)
+    entry, close = legs['entry_day'][:, None], legs['close_day'][:, None]
+    active = (day >= entry) & (day < close)
+    closing = (day == close)
+    closed = day > close
+    needs_row = active | closing
+    leg_idx, day_idx = np.nonzero(needs_row)
+    q = day_idx * n_codes + legs['code'][leg_idx]
+    pos = np.minimum(np.searchsorted(sorted_key, q), len(sorted_key) - 1)
+    if not np.all(sorted_key[pos] == q):
+        raise KeyError("Active option missing from the chain")
+    rows = np.full((n_legs, n_days), -1)
+    rows[leg_idx, day_idx] = order[pos]
+
+    bid, ask = cols['bid'][rows], cols['ask'][rows]
+    sign, is_call = legs['sign'][:, None], legs['is_call'][:, None]
+    entry_price = legs['entry_price'][:, None]
+
+    mark = _touch(legs['mtm_side'][:, None], sign < 0, bid, ask)
+    S = cols['adjusted_close'][rows]
+    K = cols['strike'][rows].astype(float)
+    expiry_px = np.maximum(0, (S - K) * np.where(is_call, 1, -1))
+    exit_px = np.where(legs['expires'][:, None], expiry_px, _touch(legs['entry_side'][:, None], sign < 0, bid, ask))
+    final_px = np.take_along_axis(exit_px, np.minimum(close, n_days - 1), axis=1)
+
+    out = {stat: np.zeros((n_legs, n_days)) for stat in STATS}
+    out['PnL'] = np.where(active, (mark - entry_price) * sign,
+                          np.where(closing | closed, (final_px - entry_price) * sign, 0.))
+
+    leg_idx, day_idx = np.nonzero(active)
+    r = rows[leg_idx, day_idx]
+    S, K, price = S[leg_idx, day_idx], K[leg_idx, day_idx], cols['pricing_mid'][r]
+    call = legs['is_call'][leg_idx]
+    if use_surface:
+        stats = {stat: cols[col][r] for stat, col in SURFACE_COLUMNS.items()}
+    else:
+        t = (legs['expiry'][leg_idx] - day_ordinals[day_idx]) / 365
+        stats = iv_and_greeks(call, S, K, t, _RATE, price)
+    out['value'][leg_idx, day_idx] = price
+    for stat, values in stats.items():
+        out[stat][leg_idx, day_idx] = values
+
+    out['active'] = active
+    out['dates'] = resolved['dates']
+    out['SPX'] = view.underlying
+    out['legs'] = legs
+    return out
+
+
+def aggregate(paths: dict) -> pd.DataFrame:
+    """
+    Portfolio level daily stats from leg paths, with the columns of Portfolio.run_backtest
+    """
+    legs = paths['legs']
+    shares = legs['shares'][:, None]
+    signed = shares * legs['sign'][:, None]
+    return pd.DataFrame({'date': paths['dates'],
+                         'SPX': paths['SPX'],
+                         'PnL': (shares * paths['PnL']).sum(axis=0),
+                         'iv': np.sqrt((shares * paths['iv'] ** 2).sum(axis=0)),
+                         'delta': (signed * paths['delta']).sum(axis=0),
+                         'gamma': (signed * paths['gamma']).sum(axis=0),
+                         'theta': (signed * paths['theta']).sum(axis=0),
+                         'vega': (signed * paths['vega']).sum(axis=0)})
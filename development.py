@@ -219,33 +219,17 @@ class Portfolio:
             print(f"Cumulative Total PnL: {daily_stats['PnL']}\n")
 
 from req_import import *
-N_prime = norm.pdf
-N = norm.cdf
 from Options import *
-
-def _vega_d1(S, d1, t):
-    return S * N_prime(d1) * sqrt(t)
+from black_scholes import implied_vol
 
 def find_iv_newton_call(S, K, r, t, market_price):
-    best_guess = np.inf
-    sigma_guess = 0.2
-    for i in range(1000):
-        bs_price = EuropeanCall.call_price(S, sigma_guess, K, t, r)
-        diff = market_price - bs_price
-        if abs(diff) < abs(market_price - best_guess):
-            best_guess = bs_price
-        if abs(diff) < 0.01:
-            return sigma_guess
-        d1 = (log(S / K) + (r + sigma_guess ** 2 / 2) * t) / (sigma_guess * sqrt(t))
-        vega = _vega_d1(S, d1, t)
-        sigma_guess += diff / vega
-    return best_guess
+    return float(implied_vol('c', S, K, t, r, market_price))
 
 if __name__ == '__main__':
     a = find_iv_newton_call(S=3932.59,
                    K=3810,
                    r=0,
                    t=0.00821917808219178,
-                   market_price=122.05)
+                   market_price=130.05)
 
     print(a)
@@ -65,7 +65,7 @@ if __name__ == '__main__':
     ######## Question 1 ########
     y = input("Enter (y/Y) to run Q1...")
     if y == 'y' or y == 'Y':
-        daily_stats = strat_1.run_backtest()
+        daily_stats = strat_1.run_backtest(sink=ConsoleSink())
         plot_cols(daily_stats,
                   'date', ['SPX', 'PnL'],
                   'Strategy 1: SPX and PnL',
@@ -75,7 +75,7 @@ if __name__ == '__main__':
     ######## Question 2, 5 ########
     y = input("Enter (y/Y) to run Q2+5...")
     if y == 'y' or y == 'Y':
-        daily_stats = strat_2.run_backtest()
+        daily_stats = strat_2.run_backtest(sink=ConsoleSink())
         plot_cols(daily_stats,
                   'date', ['SPX', 'PnL', 'iv'],
                   'Strategy 2: SPX, PnL, and IV',
@@ -84,7 +84,7 @@ if __name__ == '__main__':
     ######## Question 3, 4 ########
     y = input("Enter (y/Y) to run Q3+4...")
     if y == 'y' or y == 'Y':
-        daily_stats = strat_3.run_backtest()
+        daily_stats = strat_3.run_backtest(sink=ConsoleSink())
         plot_cols(daily_stats,
                   'date', ['SPX', 'PnL', 'delta'],
                   'Strategy 3: SPX, PnL, and Delta',
@@ -101,7 +101,7 @@ if __name__ == '__main__':
 
         for greek in ['price', 'delta', 'gamma', 'theta', 'vega']:
             for p in [p1, p2]:
-                x, y, S, K = p.plot_greek(greek, all_data=Portfolio.data)
+                x, y, S, K = p.plot_greek(greek)
                 plt.plot(x, y, label=str(p))
             plt.axvline(x=S, color='r', linestyle='--', label='S_0')
             plt.axvline(x=K, color='g', linestyle='--', label='K')
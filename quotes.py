@@ -0,0 +1,47 @@
+from req_import import *
+
+# Quote quality of every chain row, computed once when rows are preprocessed and stored as columns. Each problem is a
+# bit of ``quote_flags``. ``pricing_mid`` is the price options are valued at: the mid, or the ask when the mid is below
+# intrinsic value. It is NaN when a side is missing
+BELOW_INTRINSIC = 1
+CROSSED = 2
+ZERO_BID = 4
+MISSING = 8
+FLAGS = {'below_intrinsic': BELOW_INTRINSIC, 'crossed': CROSSED, 'zero_bid': ZERO_BID, 'missing': MISSING}
+QUOTE_DTYPES = {'intrinsic': np.dtype(np.float64), 'quote_flags': np.dtype(np.uint8),
+                'pricing_mid': np.dtype(np.float64)}
+
+
+def quote_quality(S, K, is_call, bid, ask) -> Dict[str, np.ndarray]:
+    """
+    Intrinsic value, quote flags and pricing mid of arrays of quotes
+    """
+    S, K, bid, ask = (np.asarray(a, dtype=np.float64) for a in (S, K, bid, ask))
+    intrinsic = np.maximum(np.where(is_call, S - K, K - S), 0)
+    mid = (bid + ask) / 2
+    below = mid < intrinsic
+    flags = (below * BELOW_INTRINSIC + (bid > ask) * CROSSED + (bid <= 0) * ZERO_BID +
+             (np.isnan(bid) | np.isnan(ask)) * MISSING).astype(np.uint8)
+    return {'intrinsic': intrinsic, 'quote_flags': flags, 'pricing_mid': np.where(below, ask, mid)}
+
+
+def add_quote_quality(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the QUOTE_DTYPES columns to a preprocessed chain
+    """
+    quality = quote_quality(df['adjusted_close'].values, df['strike'].values, (df['call_put'] == 'C').values,
+                            df['bid'].values, df['ask'].values)
+    return df.assign(**quality)
+
+
+def quality_report(view) -> pd.DataFrame:
+    """
+    Rows and rows with each quote problem per trade date of a ChainView, read off the stored flags only
+    """
+    counts = []
+    for i in range(view.lo, view.hi):
+        flags = view.partition(i, ['quote_flags'])['quote_flags']
+        counts.append([len(flags), *(int(np.count_nonzero(flags & bit)) for bit in FLAGS.values()),
+                       int(np.count_nonzero(flags == 0))])
+    dates = pd.Index(view.store.dates[view.lo:view.hi].astype('datetime64[D]').astype('datetime64[ns]'), name='date')
+    return pd.DataFrame(counts, index=dates, columns=['rows', *FLAGS, 'clean'], dtype=np.int64)
@@ -4,11 +4,33 @@ pd.set_option('display.max_columns', None)
 import numpy as np
 import pickle as pkl
 import os
-from typing import Optional, Literal, Any, List
+import json
+import hashlib
+import threading
+import queue
+import itertools
+from collections import OrderedDict
+import time
+import tempfile
+import platform
+import argparse
+import contextlib
+import io
+import cProfile
+import pstats
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import shutil
+import gzip
+import sqlite3
+import uuid
+from typing import Optional, Literal, Any, List, Tuple, Dict, Union
+from pandas.api.types import is_numeric_dtype, is_float_dtype, is_integer_dtype, is_datetime64_any_dtype
 from pydantic import validate_call, Field, validate_arguments
 import re
 from datetime import datetime
 import matplotlib.pyplot as plt
+from scipy.special import ndtr
 
 # Needed for jax implementation
 # import jax.numpy as np
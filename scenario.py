@@ -0,0 +1,116 @@
+from req_import import *
+from compiled import resolve_legs
+from black_scholes import bs_price_and_greeks, implied_vol
+
+# Scenario revaluation: every leg a portfolio holds on a date, repriced over a full grid of spot shocks x vol shocks x
+# days passed in one broadcast Black-Scholes evaluation. Vols are the legs' implied vols on the date, so the unshocked
+# point reprices the book at its marks
+STATS = ('price', 'delta', 'gamma', 'vega', 'theta', 'rho', 'vanna', 'volga')
+_RATE = 0.00
+_MIN_VOL = 1e-4
+
+
+def revalue(is_call, S, K, t, sigma, spot_shocks, vol_shocks, days, r=_RATE,
+            relative_vol: bool = False) -> Dict[str, np.ndarray]:
+    """
+    Price and Greeks of options over a (spot, vol, time) grid
+    :param is_call, S, K, t, sigma: Per-option arrays of the current state, t in years
+    :param spot_shocks: Relative spot moves, e.g. -0.1 for a 10% drop
+    :param vol_shocks: Vol moves, in vol points (0.05 = +5 vols) or, if ``relative_vol``, relative to each vol
+    :param days: Calendar days passed. Options expiring within them are worth intrinsic
+    :return: Stat -> (options, spot shocks, vol shocks, days) array, Greeks per share in the conventions of
+                bs_price_and_greeks
+    """
+    is_call, S, K, t, sigma = (np.asarray(a)[:, None, None, None] for a in (is_call, S, K, t, sigma))
+    spot = S * (1 + np.asarray(spot_shocks, dtype=float)[None, :, None, None])
+    vol_shocks = np.asarray(vol_shocks, dtype=float)[None, None, :, None]
+    vol = np.maximum(sigma * (1 + vol_shocks) if relative_vol else sigma + vol_shocks, _MIN_VOL)
+    t = t - np.asarray(days, dtype=float)[None, None, None, :] / 365
+    spot, vol, t = np.broadcast_arrays(spot, vol, t)
+
+    expired = t <= 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = bs_price_and_greeks(is_call, spot, K, np.where(expired, 1., t), r, vol)
+    intrinsic = np.maximum(np.where(is_call, spot - K, K - spot), 0)
+    in_the_money = intrinsic > 0
+    out['price'] = np.where(expired, intrinsic, out['price'])
+    out['delta'] = np.where(expired, np.where(in_the_money, np.where(is_call, 1., -1.), 0.), out['delta'])
+    for stat in STATS[2:]:
+        out[stat] = np.where(expired, 0., out[stat])
+    return out
+
+
+def scenario_grid(portfolio, date: str,
+                  spot_shocks=np.linspace(-0.2, 0.2, 41),
+                  vol_shocks=np.linspace(-0.1, 0.1, 21),
+                  days=(0, 1, 7, 14, 30),
+                  relative_vol: bool = False) -> dict:
+    """
+    Revalue the legs ``portfolio`` holds at the close of ``date`` over every (spot shock, vol shock, days) scenario
+    :param date: A trade date of the portfolio's window
+    :return: {'spot_shocks', 'vol_shocks', 'days': the axes, 'spot': the shocked spot levels,
+              'legs': per-leg info (symbol, is_call, strike, expiry, shares, sign, S, t, iv, price),
+              'leg': stat -> (legs, spot, vol, days) cube with each leg's shares and side applied, plus 'pnl' against
+                     the leg's unshocked value,
+              'portfolio': stat -> (spot, vol, days) cube summed over the legs}
+    """
+    view = portfolio.data_view()
+    resolved = resolve_legs(portfolio, view)
+    dates, legs = resolved['dates'], resolved['legs']
+    d = int(np.searchsorted(dates, np.datetime64(pd.Timestamp(date))))
+    assert d < len(dates) and dates[d] == np.datetime64(pd.Timestamp(date)), "Not a trade date of the portfolio"
+    held = np.flatnonzero((legs['entry_day'] <= d) & (d < legs['close_day']))
+
+    chain = view.chain(view.lo + d)
+    symbols = view.store.categories('option_symbol')[legs['code'][held]]
+    rows = np.array([chain.symbol_row(s) for s in symbols], dtype=np.int64)
+    is_call = legs['is_call'][held]
+    S = chain['adjusted_close'][rows].astype(float)
+    K = chain['strike'][rows].astype(float)
+    t = (legs['expiry'][held] - chain.ordinal) / 365
+    price = chain['pricing_mid'][rows]
+    iv = chain.surface(rows)['iv'] if chain.has_surface else implied_vol(is_call, S, K, t, _RATE, price)
+
+    cubes = revalue(is_call, S, K, t, iv, spot_shocks, vol_shocks, days, relative_vol=relative_vol)
+    multiplier = (legs['shares'] * legs['sign'])[held][:, None, None, None]
+    leg_cubes = {stat: cube * multiplier for stat, cube in cubes.items()}
+    base = revalue(is_call, S, K, t, iv, [0.], [0.], [0])['price']
+    leg_cubes['pnl'] = leg_cubes['price'] - base * multiplier
+    book = {stat: cube.sum(axis=0) for stat, cube in leg_cubes.items()}
+
+    return {'spot_shocks': np.asarray(spot_shocks, dtype=float),
+            'vol_shocks': np.asarray(vol_shocks, dtype=float),
+            'days': np.asarray(days),
+            'spot': float(chain.underlying) * (1 + np.asarray(spot_shocks, dtype=float)),
+            'legs': pd.DataFrame({'symbol': np.asarray(symbols), 'is_call': is_call, 'strike': K,
+                                  'expiry': legs['expiry'][held].astype('datetime64[D]'),
+                                  'shares': legs['shares'][held], 'sign': legs['sign'][held],
+                                  'S': S, 't': t, 'iv': iv, 'price': price}),
+            'leg': leg_cubes,
+            'portfolio': book}
+
+
+def scenario_frame(scenarios: dict) -> pd.DataFrame:
+    """
+    Portfolio cubes of scenario_grid as one row per (spot shock, vol shock, days) scenario
+    """
+    spot, vol, days = np.meshgrid(scenarios['spot_shocks'], scenarios['vol_shocks'], scenarios['days'], indexing='ij')
+    df = pd.DataFrame({'spot_shock': spot.ravel(), 'vol_shock': vol.ravel(), 'days': days.ravel()})
+    for stat, cube in scenarios['portfolio'].items():
+        df[stat] = cube.ravel()
+    return df
+
+
+def risk_ladder(scenarios: dict, stat: str = 'pnl', vol_shock: float = 0., days: int = 0) -> pd.DataFrame:
+    """
+    One portfolio stat across spot shocks (rows) for a given vol shock and number of days, per contract (legs of the
+    same option symbol summed) and in total
+    """
+    v = int(np.argmin(np.abs(scenarios['vol_shocks'] - vol_shock)))
+    n = int(np.argmin(np.abs(scenarios['days'] - days)))
+    df = pd.DataFrame({'spot_shock': scenarios['spot_shocks'], 'spot': scenarios['spot']})
+    if stat in scenarios['leg']:
+        for symbol, values in zip(scenarios['legs']['symbol'], scenarios['leg'][stat][:, :, v, n]):
+            df[symbol] = df[symbol] + values if symbol in df else values
+    df['total'] = scenarios['portfolio'][stat][:, v, n]
+    return df
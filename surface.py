@@ -0,0 +1,55 @@
+from req_import import *
+from ChainStore import ChainStore, DayChain, SURFACE_COLUMNS
+from black_scholes import iv_and_greeks
+
+# Precomputed mid-price IV/Greeks surface, persisted as extra columns of every store partition. Options are priced at
+# their pricing_mid, as in Position._pricing_inputs, with r = 0
+_RATE = 0.00
+_worker_store: Optional[ChainStore] = None
+
+
+def surface_columns(chain: DayChain) -> Dict[str, np.ndarray]:
+    S = chain['adjusted_close'].astype(float)
+    K = chain['strike'].astype(float)
+    is_call = chain['call_put'] == 'C'
+    t = (chain['expiration'] - chain.ordinal) / 365
+    stats = iv_and_greeks(is_call, S, K, t, _RATE, chain['pricing_mid'])
+    return {col: stats[stat].astype(np.float64) for stat, col in SURFACE_COLUMNS.items()}
+
+
+def _build_partition(store: ChainStore, i) -> int:
+    store.save_columns(i, surface_columns(DayChain.from_store(store, i)))
+    return i
+
+
+def _init_worker():
+    # A forked worker inherits the parent's handle, which may predate appends to the store
+    global _worker_store
+    _worker_store = None
+
+
+def _build_worker(store_fp, i) -> int:
+    global _worker_store
+    if _worker_store is None or _worker_store.path != store_fp:
+        _worker_store = ChainStore(store_fp)
+    return _build_partition(_worker_store, i)
+
+
+def build_surface(store: ChainStore, processes: Optional[int] = None) -> int:
+    """
+    Compute the surface for every trade date that does not have it yet
+    :param processes: Worker processes. Defaults to all cores, 1 computes in process
+    :return: Number of trade dates computed
+    """
+    todo = store.missing(SURFACE_COLUMNS.values())
+    if not todo:
+        return 0
+    processes = min(processes or os.cpu_count() or 1, len(todo))
+    if processes == 1:
+        done = [_build_partition(store, i) for i in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as pool:
+            done = list(pool.map(_build_worker, [store.path] * len(todo), todo,
+                                 chunksize=max(1, len(todo) // (4 * processes))))
+    store.register_columns(done, list(SURFACE_COLUMNS.values()))
+    return len(done)
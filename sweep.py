@@ -0,0 +1,75 @@
+from req_import import *
+from Dataset import registry, register_underlying, resolve_dataset
+from Portfolio import Portfolio, Position
+from ResultStore import ResultStore
+
+# Parameter sweeps over single-leg portfolios, fanned out over a process pool. Workers open the chain stores from
+# disk, so they all share the page cache of their memory-mapped partitions rather than each receiving a pickled frame
+_PORTFOLIO_KEYS = ('start_date', 'end_date', 'shares', 'underlying')
+
+
+def param_grid(**axes) -> List[dict]:
+    """
+    Cartesian product of the given parameter values, e.g. param_grid(relative_strike_pct=[-0.01, 0], call_put=['Call'])
+    """
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in itertools.product(*(axes[k] for k in keys))]
+
+
+def _init_worker(underlyings: Dict[str, Tuple[str, str]]):
+    for underlying, (csv_fp, store_fp) in underlyings.items():
+        register_underlying(underlying, csv_fp, store_fp)
+
+
+def _run_config(args) -> pd.DataFrame:
+    config_id, config, engine = args
+    position_args = {k: v for k, v in config.items() if k not in _PORTFOLIO_KEYS}
+    dataset = config.get('underlying')
+    portfolio = Portfolio(start_date=config['start_date'],
+                          end_date=config['end_date'],
+                          positions=[Position(**position_args, dataset=dataset)],
+                          shares=[config.get('shares', 1)],
+                          dataset=dataset)
+    result = portfolio.run_backtest(engine=engine)
+    result.insert(0, 'config_id', config_id)
+    return result
+
+
+def run_sweep(grid, start_date: str, end_date: str, engine: Literal['loop', 'compiled'] = 'compiled',
+              processes: Optional[int] = None, result_store: Optional[ResultStore] = None,
+              strategy: str = 'sweep') -> pd.DataFrame:
+    """
+    Backtest every configuration of the grid in parallel
+    :param grid: Dict of parameter -> values (expanded with param_grid) or a list of configurations. Keys are Position
+                    arguments, plus optionally start_date, end_date and shares to override the defaults below and
+                    underlying, a registered underlying (the default one when not given)
+    :param start_date: Backtest start of configurations that do not set their own
+    :param end_date: Backtest end of configurations that do not set their own
+    :param engine: Portfolio.run_backtest engine
+    :param processes: Worker processes. Defaults to all cores, 1 runs in process
+    :param result_store: Also store each configuration's run there, under ``strategy``, with the configuration as its
+                            config
+    :return: One row per (configuration, date) with the configuration's parameters next to its daily stats
+    """
+    configs = param_grid(**grid) if isinstance(grid, dict) else list(grid)
+    configs = [{'start_date': start_date, 'end_date': end_date, **c} for c in configs]
+    tasks = [(i, c, engine) for i, c in enumerate(configs)]
+
+    for underlying in {c.get('underlying') for c in configs}:
+        resolve_dataset(underlying).store  # Build/validate once here, not in every worker
+    processes = min(processes or os.cpu_count() or 1, len(tasks))
+    if processes <= 1:
+        results = [_run_config(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(registry(),)) as pool:
+            results = list(pool.map(_run_config, tasks, chunksize=max(1, len(tasks) // (4 * processes))))
+
+    if result_store is not None:
+        for config, result in zip(configs, results):
+            result_store.put(result.drop(columns='config_id'), strategy, config=config,
+                             dataset=resolve_dataset(config.get('underlying')), engine=engine)
+
+    params = pd.DataFrame(configs)
+    params.insert(0, 'config_id', range(len(configs)))
+    return params.merge(pd.concat(results, ignore_index=True), on='config_id')
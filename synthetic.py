@@ -0,0 +1,76 @@
+from req_import import *
+from black_scholes import bs_price
+
+# Synthetic SPX option chains in the layout of the raw input file, for benchmarks and for exercising the pipeline on
+# more (or other) data than the real file has. Spot follows a seeded random walk and quotes are Black-Scholes prices
+# of a skewed smile with a spread around them
+RAW_COLUMNS = ['symbol', 'exchange', 'date', 'adjusted close', 'unadjusted', 'expiration', 'strike', 'call/put',
+               'style', 'ask', 'bid', 'option symbol']
+
+
+def monthly_expirations(start_date, n: int) -> pd.DatetimeIndex:
+    """
+    Third Fridays of the ``n`` months from the month of ``start_date`` on
+    """
+    months = pd.date_range(pd.Timestamp(start_date).to_period('M').to_timestamp(), periods=n, freq='MS')
+    return pd.DatetimeIndex([m + pd.Timedelta(days=14 + (4 - (m + pd.Timedelta(days=14)).weekday()) % 7)
+                             for m in months])
+
+
+def synthetic_chain(n_days: int = 63,
+                    n_expirations: int = 11,
+                    n_strikes: int = 320,
+                    start_date: str = '2021-02-01',
+                    spot: float = 3800.,
+                    strike_step: float = 5.,
+                    vol: float = 0.2,
+                    skew: float = -0.8,
+                    daily_move: float = 0.01,
+                    seed: int = 0) -> pd.DataFrame:
+    """
+    Raw option chain of ``n_days`` business days, ready for Dataset.preprocess
+    :param n_expirations: Monthly expirations listed from the first trade date. Expired ones are dropped as days pass
+    :param n_strikes: Strikes per expiration, ``strike_step`` apart and centered on the initial spot
+    :param skew: Slope of the smile in log-moneyness, vol(K) = vol * (1 + skew * log(K / S))
+    :param daily_move: Daily standard deviation of the log spot
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(start_date, periods=n_days)
+    closes = np.round(spot * np.exp(np.cumsum(rng.normal(0, daily_move, n_days))), 2)
+    expirations = monthly_expirations(start_date, n_expirations)
+    strikes = strike_step * np.round(spot / strike_step) + strike_step * (
+        np.arange(n_strikes) - n_strikes // 2)
+
+    # One row per (day, expiration, strike, call/put) still alive on that day
+    d, e, k, c = (a.ravel() for a in np.meshgrid(np.arange(n_days), np.arange(n_expirations), np.arange(n_strikes),
+                                                 [True, False], indexing='ij'))
+    alive = expirations.values[e] >= days.values[d]
+    d, e, k, c = d[alive], e[alive], k[alive], c[alive]
+    S, K = closes[d], strikes[k]
+    t = (expirations.values[e] - days.values[d]) / np.timedelta64(365, 'D')
+    sigma = np.clip(vol * (1 + skew * np.log(K / S)), vol / 4, None)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mid = np.where(t > 0, bs_price(c, S, K, t, 0., sigma), np.maximum(np.where(c, S - K, K - S), 0))
+    half_spread = np.clip(0.005 * mid, 0.05, 2.5) * rng.uniform(0.5, 1.5, len(mid))
+    ask = np.round(mid + half_spread, 2)
+    bid = np.round(np.maximum(mid - half_spread, 0), 2)
+
+    exp_str = expirations.strftime('%Y-%m-%d').values
+    cp = np.where(c, 'C', 'P')
+    symbols = np.char.add(np.char.add(np.char.add('SPX', expirations.strftime('%y%m%d').values.astype(str)[e]), cp),
+                          np.char.zfill((K * 1000).astype(np.int64).astype(str), 8))
+    return pd.DataFrame({'symbol': '^SPX', 'exchange': '*',
+                         'date': days.strftime('%Y-%m-%d').values[d],
+                         'adjusted close': S, 'unadjusted': S,
+                         'expiration': exp_str[e], 'strike': K, 'call/put': cp, 'style': 'A',
+                         'ask': ask, 'bid': bid, 'option symbol': symbols}, columns=RAW_COLUMNS)
+
+
+def write_synthetic_csv(fp: str, **kwargs) -> int:
+    """
+    Write a synthetic chain (see synthetic_chain for the arguments) as a raw input csv
+    :return: Number of rows written
+    """
+    df = synthetic_chain(**kwargs)
+    df.to_csv(fp, index=False)
+    return len(df)